@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Peak memory of `spatial_overlay` relative to the size of its inputs.
+
+Overlays a grid of squares carrying a wide attribute table against a
+shifted grid with its own attribute table and reports the peak memory
+allocated during the overlay (as traced by `tracemalloc`) as a multiple of
+the memory used by the two input frames and the output frame together.
+The peak of `geopandas.overlay` on the same inputs is reported next to it
+as the baseline.
+
+Every `how` and implementation runs in a fresh Python process, so that
+first-call caches (imports, the EPSG lookup cache, the geometry metadata
+store) are not counted against whichever case happens to run first.
+
+Usage: $python benchmarks/bench_memory.py [n_side] [n_columns]
+
+"""
+
+import json
+import subprocess
+import sys
+import tracemalloc
+import warnings
+
+import numpy
+from geopandas import GeoDataFrame
+from shapely.geometry import box
+
+HOWS = ['intersection', 'difference', 'symmetric_difference', 'identity', 'union']
+
+
+def wide_grid(n_side, n_columns, offset=0.0, prefix='col'):
+    cells = [box(x + offset, y + offset, x + offset + 1, y + offset + 1)
+             for x in range(n_side) for y in range(n_side)]
+    data = {'{}{}'.format(prefix, i): numpy.random.rand(len(cells))
+            for i in range(n_columns)}
+    data['geometry'] = cells
+    return GeoDataFrame(data, geometry='geometry')
+
+
+def run_case(n_side, n_columns, how, impl):
+    """Runs one case in the current process and returns its result row."""
+    import geopandas
+    from geopandas_ext import spatial_overlay
+
+    warnings.simplefilter('ignore')
+    numpy.random.seed(0)
+    df1 = wide_grid(n_side, n_columns)
+    df2 = wide_grid(n_side, n_columns, offset=0.5, prefix='attr')
+    input_size = (df1.memory_usage(deep=False).sum() +
+                  df2.memory_usage(deep=False).sum())
+
+    tracemalloc.start()
+    if impl == 'geopandas_ext':
+        df = spatial_overlay(df1, df2, how=how)
+    else:
+        df = geopandas.overlay(df1, df2, how=how)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(peak=int(peak), input_size=int(input_size),
+                output_size=int(df.memory_usage(deep=False).sum()))
+
+
+def spawn_case(**case):
+    """Runs one case in a child process and returns its result row."""
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--case', json.dumps(case)])
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(n_side=60, n_columns=100):
+    print('{:<22}{:>12}{:>12}{:>12}{:>8}{:>15}{:>8}'.format(
+        'how', 'peak (MB)', 'inputs (MB)', 'output (MB)', 'ratio',
+        'baseline (MB)', 'ratio'))
+    for how in HOWS:
+        ext = spawn_case(n_side=n_side, n_columns=n_columns, how=how, impl='geopandas_ext')
+        base = spawn_case(n_side=n_side, n_columns=n_columns, how=how, impl='geopandas')
+        print('{:<22}{:>12.1f}{:>12.1f}{:>12.1f}{:>8.2f}{:>15.1f}{:>8.2f}'.format(
+            how, ext['peak'] / 1e6, ext['input_size'] / 1e6, ext['output_size'] / 1e6,
+            float(ext['peak']) / (ext['input_size'] + ext['output_size']),
+            base['peak'] / 1e6,
+            float(base['peak']) / (base['input_size'] + base['output_size'])))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--case']:
+        print(json.dumps(run_case(**json.loads(sys.argv[2]))))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
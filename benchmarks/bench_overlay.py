@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Wall time and peak memory of `spatial_overlay` against `geopandas.overlay`.
+
+Runs every combination of data set, size, `how` and option, each in a fresh
+Python process so that the peak resident set size (RSS) of one case does
+not leak into the next, and prints one row per case. 'peak' is the peak RSS
+of the process and 'extra' how much the overlay raised it above the peak
+reached while generating the inputs.
+
+Usage: $python benchmarks/bench_overlay.py [--data grid points nested]
+           [--sizes 1000 10000] [--how intersection union ...]
+           [--options default explode no_index reproject] [--no-baseline]
+           [--csv results.csv]
+
+The data sets are described in `generators.py`. Sizes of 100k and 1M
+features are supported but take minutes to hours per case, particularly
+for the baseline.
+
+"""
+
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+import warnings
+
+HOWS = ['intersection', 'difference', 'symmetric_difference', 'identity', 'union']
+
+OPTIONS = {
+    'default': {},
+    'explode': {'explode': True},
+    'no_index': {'keep_index': False},
+    'reproject': {'reproject': True},
+}
+
+COLUMNS = ['data', 'n', 'how', 'option', 'impl', 'seconds', 'peak_mb', 'extra_mb', 'rows']
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # windows
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_case(data, n, how, option, impl):
+    """Runs one case in the current process and returns its result row."""
+    import geopandas
+    from geopandas_ext import spatial_overlay
+    from generators import GENERATORS
+
+    warnings.simplefilter('ignore')
+    df1, df2 = GENERATORS[data](n)
+    kwargs = dict(OPTIONS[option])
+    if kwargs.pop('reproject', False):
+        df2 = df2.to_crs('EPSG:4326')
+
+    before = _peak_rss_mb()
+    start = time.time()
+    if impl == 'geopandas_ext':
+        df = spatial_overlay(df1, df2, how=how, **kwargs)
+    else:
+        if df2.crs != df1.crs:
+            df2 = df2.to_crs(df1.crs)
+        df = geopandas.overlay(df1, df2, how=how)
+        if kwargs.get('explode'):
+            df = df.explode(index_parts=False)
+    seconds = time.time() - start
+    peak = _peak_rss_mb()
+
+    return dict(data=data, n=n, how=how, option=option, impl=impl,
+                seconds=round(seconds, 3), peak_mb=round(peak, 1),
+                extra_mb=round(peak - before, 1), rows=len(df))
+
+
+def spawn_case(**case):
+    """Runs one case in a child process and returns its result row."""
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--case', json.dumps(case)])
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', nargs='+', default=['grid', 'points', 'nested'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--how', nargs='+', default=HOWS)
+    parser.add_argument('--options', nargs='+', default=list(OPTIONS))
+    parser.add_argument('--no-baseline', action='store_true',
+                        help='skip geopandas.overlay')
+    parser.add_argument('--csv', help='also write the results to this file')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(**json.loads(args.case))))
+        return
+
+    impls = ['geopandas_ext'] if args.no_baseline else ['geopandas_ext', 'geopandas']
+    header = '{:<8}{:>9}  {:<22}{:<11}{:<15}{:>9}{:>10}{:>10}{:>9}'
+    row = '{data:<8}{n:>9}  {how:<22}{option:<11}{impl:<15}{seconds:>9.3f}' \
+          '{peak_mb:>10.1f}{extra_mb:>10.1f}{rows:>9}'
+    print(header.format(*COLUMNS))
+
+    results = []
+    for data in args.data:
+        for n in args.sizes:
+            for how in args.how:
+                for option in args.options:
+                    for impl in impls:
+                        result = spawn_case(data=data, n=n, how=how, option=option, impl=impl)
+                        print(row.format(**result))
+                        sys.stdout.flush()
+                        results.append(result)
+
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
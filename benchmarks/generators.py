@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Synthetic polygon layers for the `spatial_overlay` benchmarks.
+
+Every generator returns a pair of GeoDataFrames (`df1`, `df2`) in a projected
+crs (EPSG:2263, US feet) with about `n` features each, so that the timing of
+a benchmark scales with `n` rather than with the shape of the data.
+
+"""
+
+import numpy
+from geopandas import GeoDataFrame
+from shapely.geometry import Point, box
+
+CRS = 'EPSG:2263'
+
+
+def _frame(geoms, prefix, seed=0):
+    rng = numpy.random.RandomState(seed)
+    data = {
+        '{}_id'.format(prefix): numpy.arange(len(geoms)),
+        '{}_value'.format(prefix): rng.rand(len(geoms)),
+        'geometry': geoms,
+    }
+    return GeoDataFrame(data, geometry='geometry', crs=CRS)
+
+
+def grid(n, size=100.0):
+    """Two square grids of about `n` cells each, the second shifted by half
+    a cell in both directions so that every cell overlaps four others.
+    """
+    side = max(int(round(n ** 0.5)), 1)
+    offsets = numpy.arange(side) * size
+    cells1 = [box(x, y, x + size, y + size) for x in offsets for y in offsets]
+    cells2 = [box(x + size / 2, y + size / 2, x + 1.5 * size, y + 1.5 * size)
+              for x in offsets for y in offsets]
+    return _frame(cells1, 'grid1'), _frame(cells2, 'grid2', seed=1)
+
+
+def buffered_points(n, density=1.0, seed=0):
+    """Two layers of `n` circles around random points each. `density` is
+    about the number of circles of the other layer each circle meets.
+    """
+    rng = numpy.random.RandomState(seed)
+    extent = 1000.0 * n ** 0.5
+    radius = extent * (density / (4 * numpy.pi * n)) ** 0.5
+
+    def circles():
+        xy = rng.rand(n, 2) * extent
+        return [Point(x, y).buffer(radius * rng.uniform(0.5, 1.5)) for x, y in xy]
+
+    return _frame(circles(), 'pts1'), _frame(circles(), 'pts2', seed=1)
+
+
+def nested(n, n_outer=None, size=100.0, seed=0):
+    """`n` small parcels against about `n_outer` large districts
+    (`n` / 100 by default) that each cover many whole parcels, the common
+    case of parcels overlaid with zoning.
+    """
+    rng = numpy.random.RandomState(seed)
+    side = max(int(round(n ** 0.5)), 1)
+    offsets = numpy.arange(side) * size
+    parcels = [box(x + 5, y + 5, x + size - 5 - rng.rand() * 20, y + size - 5)
+               for x in offsets for y in offsets]
+
+    n_outer = n_outer or max(n // 100, 1)
+    outer_side = max(int(round(n_outer ** 0.5)), 1)
+    step = side * size / outer_side
+    districts = [box(i * step + 30, j * step + 30, (i + 1) * step + 30, (j + 1) * step + 30)
+                 for i in range(outer_side) for j in range(outer_side)]
+    return _frame(parcels, 'parcel'), _frame(districts, 'district', seed=1)
+
+
+GENERATORS = {
+    'grid': grid,
+    'points': buffered_points,
+    'nested': nested,
+}
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from .spatial_overlay import spatial_overlay
+from .spatial_overlay import (
+    spatial_overlay, spatial_overlay_files, flatten_overlaps, multi_overlay,
+    tabulate_intersection, apportion, update_overlay, OverlayLayer)
+from .overlay_stats import OverlayStats
+from .metadata import GeometryMetadata, geometry_metadata
 from .epsg_utils import *
 from .polygon_geom import *
 from .tests import test
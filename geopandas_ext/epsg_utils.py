@@ -1,34 +1,148 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+import csv
+import gzip
+import os
+import warnings
+
 import fiona
-import pyepsg
 
 
-def epsg_to_dict(epsg):
+__all__ = ['epsg_to_dict', 'crs_units', 'batch_crs_units']
+
+EPSG_TABLE = os.path.join(os.path.dirname(__file__), 'data', 'epsg.csv.gz')
+
+# Sources consulted, in order, for codes missing from the bundled table.
+# Empty by default so that no lookup ever leaves the process; add 'pyproj'
+# and/or 'network' (epsg.io via `pyepsg`) to enable them. It is not
+# re-exported by the package, so set it on this module, e.g.
+# `geopandas_ext.epsg_utils.EPSG_FALLBACK = ('pyproj',)`.
+EPSG_FALLBACK = ()
+
+_CACHE_SIZE = 256
+
+
+class _LRUCache(object):
+    """Least recently used cache of at most `maxsize` items."""
+
+    def __init__(self, maxsize=_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+_table = None
+_cache = _LRUCache()
+
+
+def _epsg_table():
+    """Returns the bundled {epsg: (proj4, units)} table, read on first use."""
+    global _table
+    if _table is None:
+        with gzip.open(EPSG_TABLE, 'rb') as f:
+            lines = f.read().decode('ascii').splitlines()
+        reader = csv.reader(lines[1:])
+        _table = dict((int(code), (proj4, units)) for code, proj4, units in reader)
+    return _table
+
+
+def _lookup(epsg, fallback=None):
+    """Returns the (proj4, units) of an EPSG code from the bundled table, or
+    from the `fallback` sources (default `EPSG_FALLBACK`) when it is not in
+    the table. `units` is None when it is not known.
+    """
+    epsg = int(epsg)
+    if epsg in _cache:
+        return _cache.get(epsg)
+
+    found = _epsg_table().get(epsg)
+    if found is not None:
+        found = (found[0], found[1] or None)
+
+    for source in EPSG_FALLBACK if fallback is None else fallback:
+        if found is not None:
+            break
+        if source == 'pyproj':
+            import pyproj
+            try:
+                proj4 = pyproj.CRS.from_epsg(epsg).to_proj4()
+            except pyproj.exceptions.CRSError:
+                proj4 = None
+            if proj4:
+                found = (proj4.replace(' +type=crs', ''), None)
+        elif source == 'network':
+            import pyepsg
+            found = (pyepsg.get(epsg).as_proj4().strip(), None)
+        else:
+            raise ValueError(
+                "`fallback` was {} but is expected to be in {}".format(
+                    source, ['pyproj', 'network']))
+
+    if found is None:
+        raise ValueError(
+            'EPSG code {} is not in the bundled table. Enable a fallback '
+            'lookup with `fallback=("pyproj", "network")`.'.format(epsg))
+
+    _cache.put(epsg, found)
+    return found
+
+
+def epsg_to_dict(epsg, fallback=None):
     """Converts an EPSG code to a full proj4 dictionary.
 
+    Codes are looked up in a table bundled with the package and cached, so
+    no network access is needed.
+
     Parameters
     ----------
     epsg : int
         e EPSG code to lookup
+    fallback : sequence of string, optional
+        sources consulted for codes missing from the table: 'pyproj' and/or
+        'network' (epsg.io). Defaults to `EPSG_FALLBACK`, which is empty;
+        set `geopandas_ext.epsg_utils.EPSG_FALLBACK` to change the default
+        of every lookup.
 
     Returns
     -------
     dict
 
     """
-    p = pyepsg.get(epsg).as_proj4()
+    p, _ = _lookup(epsg, fallback)
     return fiona.crs.from_string(p)
 
 
-def crs_units(crs):
+def crs_units(crs, fallback=None):
     """Fetches the units from a crs dictionary. If an epsg code is passed in,
-    it is converted to a dict. Supports fiona crs dictionary formats.
+    it is converted to a dict. Supports fiona crs dictionary formats and crs
+    objects such as the `pyproj.CRS` of a GeoDataFrame.
 
     Parameters
     ----------
-    crs : dict or int
-        is the dict or epsg code to fetch the spatial units.
+    crs : dict, int or crs object
+        is the dict, epsg code or crs to fetch the spatial units.
+    fallback : sequence of string, optional
+        see `epsg_to_dict`.
 
     Returns
     -------
@@ -39,9 +153,26 @@ def crs_units(crs):
 
     if isinstance(crs, int):
         epsg = crs
-        crs_dict = epsg_to_dict(epsg)
+        _, units = _lookup(epsg, fallback)
+        if units is not None:
+            return units
+        crs_dict = epsg_to_dict(epsg, fallback)
         return crs_units(crs_dict)
 
+    if hasattr(crs, 'to_epsg') and hasattr(crs, 'to_dict'):  # pyproj or fiona CRS
+        if getattr(crs, 'is_geographic', False):
+            return 'degrees'
+        epsg = crs.to_epsg()
+        if epsg is not None:
+            try:
+                return crs_units(int(epsg), fallback)
+            except ValueError:  # not in the bundled table
+                pass
+        with warnings.catch_warnings():
+            # pyproj warns that a proj4 dict loses information; the units remain
+            warnings.simplefilter('ignore')
+            return crs_units(crs.to_dict(), fallback)
+
     if isinstance(crs, dict):
         if 'units' in crs:
             return crs['units']
@@ -50,8 +181,7 @@ def crs_units(crs):
             if "init" in crs:
                 if 'epsg' in crs.get('init').lower():
                     _, epsg = crs['init'].split(":")
-                    crs_dict = epsg_to_dict(epsg)
-                    return crs_units(crs_dict)
+                    return crs_units(int(epsg), fallback)
 
             elif 'datum' in crs:
                 if 'wgs' in crs.get('datum').lower():
@@ -64,6 +194,28 @@ def crs_units(crs):
         raise Exception('crs must be epsg or `dict` format')
 
 
+def batch_crs_units(crss, fallback=None):
+    """Fetches the units of many crs at once, e.g. of all the layers of a
+    job. Each distinct crs is resolved only once.
 
+    Parameters
+    ----------
+    crss : sequence of dict or int
+        see `crs_units`.
+    fallback : sequence of string, optional
+        see `epsg_to_dict`.
 
+    Returns
+    -------
+    list of string
+        the units of each crs in `crss`.
 
+    """
+    resolved = {}
+    units = []
+    for crs in crss:
+        key = tuple(sorted(crs.items())) if isinstance(crs, dict) else crs
+        if key not in resolved:
+            resolved[key] = crs_units(crs, fallback)
+        units.append(resolved[key])
+    return units
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import weakref
+
+import numpy
+
+try:  # shapely >= 2.0 ships vectorized geometry operations
+    from shapely import area as _area_v
+    from shapely import bounds as _bounds_v
+    from shapely import get_num_coordinates as _num_coordinates_v
+    from shapely import get_type_id as _type_id_v
+    from shapely import is_valid as _is_valid_v
+    from shapely import length as _length_v
+except ImportError:
+    _area_v = _bounds_v = _num_coordinates_v = _type_id_v = _is_valid_v = None
+    _length_v = None
+
+
+# shapely's geometry type ids; -1 stands for a missing geometry
+GEOMETRY_TYPE_IDS = {
+    'Point': 0,
+    'LineString': 1,
+    'LinearRing': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+POLYGON_TYPE_IDS = [GEOMETRY_TYPE_IDS['Polygon'], GEOMETRY_TYPE_IDS['MultiPolygon']]
+
+LINE_TYPE_IDS = [GEOMETRY_TYPE_IDS['LineString'], GEOMETRY_TYPE_IDS['LinearRing'],
+                 GEOMETRY_TYPE_IDS['MultiLineString']]
+
+
+class GeometryMetadata(object):
+    """Derived data of an array of geometries: bounds, geometry type ids,
+    validity, vertex counts and area. Each is computed in one vectorized
+    pass on first use and then kept.
+
+    Parameters
+    ----------
+    geoms : 1-D object array of shapely geometries
+
+    Attributes
+    ----------
+    geoms : 1-D object array
+    bounds : (n, 4) float array of (minx, miny, maxx, maxy), NaN for empty
+        geometries
+    type_ids : 1-D integer array, see `GEOMETRY_TYPE_IDS`
+    valid : 1-D boolean array
+    vertex_counts : 1-D integer array
+    area : 1-D float array
+
+    """
+
+    def __init__(self, geoms):
+        self.geoms = geoms
+        self._values = {}
+
+    def _get(self, name, func):
+        if name not in self._values:
+            self._values[name] = func(self.geoms)
+        return self._values[name]
+
+    @property
+    def bounds(self):
+        return self._get('bounds', _bounds)
+
+    @property
+    def type_ids(self):
+        return self._get('type_ids', _type_ids)
+
+    @property
+    def valid(self):
+        return self._get('valid', _validity)
+
+    @property
+    def vertex_counts(self):
+        return self._get('vertex_counts', _vertex_counts)
+
+    @property
+    def area(self):
+        return self._get('area', _area)
+
+    def is_polygonal(self):
+        """Boolean mask of the Polygon and MultiPolygon geometries."""
+        return numpy.isin(self.type_ids, POLYGON_TYPE_IDS)
+
+    def is_lineal(self):
+        """Boolean mask of the LineString, LinearRing and MultiLineString
+        geometries."""
+        return numpy.isin(self.type_ids, LINE_TYPE_IDS)
+
+
+# id(frame) -> (weak reference to the frame, fingerprint, GeometryMetadata)
+_store = {}
+
+
+def geometry_metadata(gdf):
+    """Returns the `GeometryMetadata` of the active geometry column of `gdf`.
+
+    The metadata is cached against the frame for as long as the frame
+    exists, and recomputed when its geometries change, so that every
+    function of the package that checks, indexes or repairs the same frame
+    shares one set of arrays. A lookup compares the addresses of the
+    geometry objects in the column with those cached, read from the array
+    in one pass. Functions that need the metadata several times look it up
+    once and pass it on.
+
+    Parameters
+    ----------
+    gdf : GeoDataFrame
+
+    Returns
+    -------
+    GeometryMetadata
+
+    """
+    geoms = _object_array(gdf.geometry.values)
+    fingerprint = _fingerprint(geoms)
+
+    key = id(gdf)
+    entry = _store.get(key)
+    if (entry is not None and entry[0]() is gdf and
+            numpy.array_equal(entry[1], fingerprint)):
+        return entry[2]
+
+    # a copy, so that the metadata holds on to the geometries it describes
+    # (and their addresses are not reused) even if the column of the frame
+    # is modified in place.
+    metadata = GeometryMetadata(geoms.copy())
+    _store[key] = (weakref.ref(gdf, _evict(key)), fingerprint, metadata)
+    return metadata
+
+
+def _evict(key):
+    def callback(ref):
+        if _store.get(key, (None,))[0] is ref:
+            del _store[key]
+    return callback
+
+
+def _fingerprint(geoms):
+    """Identifies the geometry objects in `geoms` by their addresses (their
+    `id`), read straight from the buffer of the object array rather than
+    with one call to `id` per geometry. Shapely geometries are immutable and
+    the cached metadata keeps them alive, so the same addresses mean the
+    same geometries.
+    """
+    geoms = numpy.ascontiguousarray(geoms)
+    if not len(geoms):
+        return numpy.empty(0, dtype=numpy.uint64)
+    pointers = (ctypes.c_size_t * len(geoms)).from_address(geoms.ctypes.data)
+    return numpy.ctypeslib.as_array(pointers).astype(numpy.uint64)
+
+
+def _object_array(geoms):
+    """Packs a sequence of geometries into a 1-D object array without numpy
+    trying to unpack multipart geometries into nested sequences.
+    """
+    if isinstance(geoms, numpy.ndarray) and geoms.dtype == object:
+        return geoms
+    if hasattr(geoms, '__array__'):  # e.g. a geopandas GeometryArray
+        arr = numpy.asarray(geoms)
+        if arr.dtype == object and arr.shape == (len(geoms),):
+            return arr
+    arr = numpy.empty(len(geoms), dtype=object)
+    for i, geom in enumerate(geoms):
+        arr[i] = geom
+    return arr
+
+
+def _bounds(geoms):
+    """Returns the bounds of every geometry in the array `geoms` as an (n, 4)
+    float array of (minx, miny, maxx, maxy). Empty geometries have NaN
+    bounds.
+    """
+    if _bounds_v is not None:
+        return _bounds_v(geoms).reshape(-1, 4)
+
+    bounds = numpy.full((len(geoms), 4), numpy.nan)
+    for i, geom in enumerate(geoms):
+        if geom is not None and not geom.is_empty:
+            bounds[i] = geom.bounds
+    return bounds
+
+
+def _type_ids(geoms):
+    """Returns the geometry type id of every geometry in `geoms`."""
+    if _type_id_v is not None:
+        return _type_id_v(geoms)
+    return numpy.array(
+        [-1 if g is None else GEOMETRY_TYPE_IDS[g.geom_type] for g in geoms],
+        dtype=numpy.intp)
+
+
+def _validity(geoms):
+    """Returns whether each geometry in `geoms` is valid."""
+    if _is_valid_v is not None:
+        return _is_valid_v(geoms)
+    return numpy.array([g is not None and g.is_valid for g in geoms], dtype=bool)
+
+
+def _vertex_counts(geoms):
+    """Returns the number of vertices of each geometry in `geoms`."""
+    if _num_coordinates_v is not None:
+        return _num_coordinates_v(geoms)
+
+    counts = numpy.zeros(len(geoms), dtype=numpy.intp)
+    for i, geom in enumerate(geoms):
+        if geom is None:
+            continue
+        for part in getattr(geom, 'geoms', [geom]):
+            if part.is_empty:
+                continue
+            if hasattr(part, 'exterior'):
+                rings = [part.exterior] + list(part.interiors)
+                counts[i] += sum(len(ring.coords) for ring in rings)
+            else:
+                counts[i] += len(part.coords)
+    return counts
+
+
+def _area(geoms):
+    """Returns the area of each geometry in `geoms`."""
+    if _area_v is not None:
+        return _area_v(geoms)
+    return numpy.array([0.0 if g is None else g.area for g in geoms])
+
+
+def _length(geoms):
+    """Returns the length of each geometry in `geoms`."""
+    if _length_v is not None:
+        return _length_v(geoms)
+    return numpy.array([0.0 if g is None else g.length for g in geoms])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import time
+
+
+class OverlayStats(object):
+    """Collects counters and wall times while an overlay runs. Pass an
+    instance as `stats` to `spatial_overlay` and read it afterwards.
+
+    Stages are timed as 'total', 'reproject', 'snap', 'repair', 'index',
+    'query', 'intersection', 'difference', 'assemble' and 'explode', and
+    tiled overlays add 'tiling' and 'merge' and count the 'tiles'.
+    Polygonizing (`flatten_overlaps`, the 'polygonize' engine) adds 'node',
+    'polygonize' and 'label' and counts the 'faces', and `multi_overlay`
+    times its join order as 'plan'. Stages can nest (e.g. 'repair' of the
+    outputs is part of 'intersection'), so the timings do not add up to
+    'total'. The counters include 'candidate_pairs', 'intersections',
+    'empty_discarded', 'repaired_input', 'repaired_output', the pairs
+    resolved by predicates ('pairs_within', 'pairs_contains',
+    'pairs_disjoint' and, with a `grid_size`, 'pairs_touching') and
+    'output_rows'.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        called as `callback(kind, name, value)` with kind 'count' or
+        'timing' every time a counter or timing is recorded, e.g. to forward
+        them to a metrics system.
+
+    Attributes
+    ----------
+    counts : OrderedDict
+        e.g. {'repaired_input': 2, 'repaired_output': 0}
+    timings : OrderedDict
+        accumulated seconds per stage, e.g. {'repair': 0.013}
+
+    """
+
+    def __init__(self, callback=None):
+        self.counts = OrderedDict()
+        self.timings = OrderedDict()
+        self.callback = callback
+
+    def count(self, name, n=1):
+        """Adds `n` to the counter `name`."""
+        n = int(n)
+        self.counts[name] = self.counts.get(name, 0) + n
+        if self.callback is not None:
+            self.callback('count', name, n)
+
+    def add_time(self, name, seconds):
+        """Adds `seconds` to the timing `name`."""
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if self.callback is not None:
+            self.callback('timing', name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager that adds the wall time of its block to the
+        timing `name`.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def merge(self, other):
+        """Adds the counters and timings of `other`, e.g. the stats returned
+        by a worker process, to these ones.
+        """
+        for name, n in other.counts.items():
+            self.count(name, n)
+        for name, seconds in other.timings.items():
+            self.add_time(name, seconds)
+
+    def to_dict(self):
+        """Returns the counters and timings as one flat dict with keys like
+        'counts.candidate_pairs' and 'timings.index'.
+        """
+        flat = OrderedDict()
+        for prefix, values in [('counts', self.counts), ('timings', self.timings)]:
+            for name, value in values.items():
+                flat['{}.{}'.format(prefix, name)] = value
+        return flat
+
+    def __getstate__(self):
+        # callbacks do not travel to worker processes
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    def __repr__(self):
+        return 'OverlayStats(counts={}, timings={})'.format(
+            dict(self.counts), dict(self.timings))
+
+
+class _NullStats(object):
+    """Stand-in for `OverlayStats` when no stats are collected."""
+
+    def count(self, name, n=1):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    def add_time(self, name, seconds):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+def _stats_or_null(stats):
+    return _NullStats() if stats is None else stats
@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+
+import numpy
+import pandas
 import geopandas
 from shapely.geometry import Polygon, MultiPolygon
 
+from .metadata import geometry_metadata, _object_array
+
+try:  # shapely >= 2.0 ships vectorized geometry operations
+    from shapely import get_parts as _get_parts_v
+    from shapely import is_empty as _is_empty_v
+except ImportError:
+    _get_parts_v = _is_empty_v = None
+
 
 def explode_multipart_polygons(gdf):
     """separates multipart polygon geometries into a GeoDataFrame with single
@@ -10,6 +22,10 @@ def explode_multipart_polygons(gdf):
 
     adapted from @jwass https://github.com/geopandas/geopandas/issues/174#issuecomment-63126908
 
+    The parts are split off in one vectorized pass and the attribute columns
+    are gathered with `take` on the parent position of each part, rather
+    than merged back onto the parts.
+
     Parameters
     ----------
     gdf : geopandas.GeoDataFrame
@@ -18,29 +34,61 @@ def explode_multipart_polygons(gdf):
     Returns
     -------
     outdf : geopandas.GeoDataFrame
-        Exploded GeoDataFrame
+        Exploded GeoDataFrame with a new range index
 
     """
-    if (gdf.geom_type.apply(lambda x: x in ['Polygon', 'MultiPolygon']).sum() != len(gdf.index)):
+    metadata = geometry_metadata(gdf)
+    if not metadata.is_polygonal().all():
         raise TypeError(
             "explode_multipart_polygons only takes GeoDataFrames with (multi)polygon geometries")
 
-    exploded = (
-        gdf
-        .explode()
-        .reset_index()
-        .rename(columns={0: 'geometry'})
-        .merge(gdf.drop('geometry', axis=1), left_on='level_0', right_index=True)
-        .set_geometry('geometry')
-        .drop(['level_0', 'level_1'], axis=1)
-    )
+    parts, parents = explode_geometries(metadata.geoms)
 
-    exploded.crs = gdf.crs
+    geometry = gdf.geometry.name
+    data = OrderedDict()
+    for i, column in enumerate(gdf.columns):
+        if column == geometry:
+            data[column] = parts
+        else:
+            data[column] = gdf.iloc[:, i].values.take(parents)
+
+    exploded = geopandas.GeoDataFrame(
+        pandas.DataFrame(data, columns=gdf.columns), geometry=geometry, crs=gdf.crs)
 
     return exploded
 
 
-def gdf_bbox(gdf):
+def explode_geometries(geoms):
+    """Splits an array of (multipart) geometries into its single parts.
+
+    Parameters
+    ----------
+    geoms : 1-D object array of shapely geometries
+
+    Returns
+    -------
+    parts : 1-D object array
+        the non-empty single part geometries, in order.
+    parents : 1-D integer array
+        the position in `geoms` of the geometry each part came from.
+
+    """
+    geoms = _object_array(geoms)
+    if _get_parts_v is not None:
+        parts, parents = _get_parts_v(geoms, return_index=True)
+        keep = ~_is_empty_v(parts)
+        return parts[keep], parents[keep].astype(numpy.intp)
+
+    counts = numpy.zeros(len(geoms), dtype=numpy.intp)
+    parts = []
+    for i, geom in enumerate(geoms):
+        pieces = [p for p in getattr(geom, 'geoms', [geom]) if not p.is_empty]
+        counts[i] = len(pieces)
+        parts.extend(pieces)
+    return _object_array(parts), numpy.repeat(numpy.arange(len(geoms)), counts)
+
+
+def gdf_bbox(gdf, densify=0):
     """Creates a projected bounding box dataframe from the geometries of the
     input geodataframe. This gdf can be reprojected with the GeoDataFrame.to_crs
     method.
@@ -48,15 +96,128 @@ def gdf_bbox(gdf):
     Parameters
     ----------
     gdf : GeoDataFrame
+    densify : int, optional (default=0)
+        number of vertices added along each edge of the box, so that the
+        reprojected box follows the curved image of its edges.
 
     """
 
     minx, miny, maxx, maxy = gdf.total_bounds
 
+    corners = [[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny]]
+    if densify:
+        steps = numpy.linspace(0, 1, densify + 2)[:-1]
+        ring = []
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+            ring.extend(zip(x0 + (x1 - x0) * steps, y0 + (y1 - y0) * steps))
+        corners = ring
+
     p = geopandas.GeoDataFrame(
-        [{'geometry': Polygon([[minx, miny], [minx, maxy], [
-                              maxx, maxy], [maxx, miny]])}],
+        [{'geometry': Polygon(corners)}],
         crs=gdf.crs
     )
 
     return p
+
+
+CURVES = ['hilbert', 'morton']
+
+
+def spatial_keys(gdf, curve='hilbert', level=16):
+    """Computes a space filling curve key for every row of a geodataframe
+    from the center of its bounds, so that rows close in the key order are
+    close on the ground.
+
+    Parameters
+    ----------
+    gdf : GeoDataFrame
+    curve : string, optional (default='hilbert')
+        'hilbert' or 'morton' (z-order). Hilbert keys keep neighbouring
+        cells closer together; Morton keys are cheaper to compute.
+    level : int, optional (default=16)
+        number of bits per axis of the grid the extent of `gdf` is divided
+        into, at most 31.
+
+    Returns
+    -------
+    keys : 1-D uint64 array
+        rows with empty or missing geometries get the largest key.
+
+    """
+    return _curve_keys(geometry_metadata(gdf).bounds, curve, level)
+
+
+def sort_spatially(gdf, curve='hilbert', level=16):
+    """Sorts the rows of a geodataframe along a space filling curve, see
+    `spatial_keys`. The index is kept, so `sort_index` restores the
+    original order.
+
+    Returns
+    -------
+    GeoDataFrame
+
+    """
+    order = numpy.argsort(spatial_keys(gdf, curve, level), kind='mergesort')
+    return gdf.iloc[order]
+
+
+def _curve_keys(bounds, curve='hilbert', level=16):
+    """Returns the `curve` keys of the centers of an (n, 4) array of bounds
+    on a 2**`level` by 2**`level` grid over their extent.
+    """
+    if curve not in CURVES:
+        raise ValueError(
+            "`curve` was {} but is expected to be in {}".format(curve, CURVES))
+    if not 0 < level < 32:
+        raise ValueError('`level` must be between 1 and 31, got {}'.format(level))
+
+    keys = numpy.full(len(bounds), numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+    finite = numpy.isfinite(bounds).all(axis=1)
+    if not finite.any():
+        return keys
+
+    cx = (bounds[finite, 0] + bounds[finite, 2]) / 2
+    cy = (bounds[finite, 1] + bounds[finite, 3]) / 2
+    side = 2 ** level
+    cells = []
+    for c in [cx, cy]:
+        span = c.max() - c.min()
+        scaled = (c - c.min()) / span * (side - 1) if span > 0 else numpy.zeros(len(c))
+        cells.append(scaled.astype(numpy.uint64))
+    x, y = cells
+
+    if curve == 'morton':
+        keys[finite] = _interleave(x, level) | (_interleave(y, level) << numpy.uint64(1))
+    else:
+        keys[finite] = _hilbert(x, y, level)
+    return keys
+
+
+def _interleave(v, level):
+    """Spreads the bits of `v` apart, leaving a zero bit between each."""
+    out = numpy.zeros_like(v)
+    for bit in range(level):
+        out |= ((v >> numpy.uint64(bit)) & numpy.uint64(1)) << numpy.uint64(2 * bit)
+    return out
+
+
+def _hilbert(x, y, level):
+    """Returns the distance along the Hilbert curve of the cells `x`, `y` of a
+    2**`level` grid, rotating the quadrants as in the classic `xy2d`.
+    """
+    x, y = x.copy(), y.copy()
+    d = numpy.zeros_like(x)
+    n = numpy.uint64(2 ** level)
+    s = n >> numpy.uint64(1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((numpy.uint64(3) * rx.astype(numpy.uint64)) ^ ry.astype(numpy.uint64))
+
+        flip = ~ry & rx
+        x[flip] = n - numpy.uint64(1) - x[flip]
+        y[flip] = n - numpy.uint64(1) - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s >>= numpy.uint64(1)
+    return d
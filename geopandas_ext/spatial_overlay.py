@@ -1,17 +1,92 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import reduce
+import hashlib
+import multiprocessing
+import os
+import time
 import warnings
 
+import fiona
 import numpy
 import pandas
 import geopandas
+import rtree
 from geopandas import GeoDataFrame, GeoSeries
+from shapely.geometry import MultiPolygon, Polygon, box, mapping
+from shapely.ops import polygonize, transform, unary_union
+from shapely.prepared import prep
 
-from .polygon_geom import explode_multipart_polygons
+from .metadata import (
+    geometry_metadata, _area, _bounds, _length, _object_array, _vertex_counts)
+from .epsg_utils import crs_units
+from .overlay_stats import OverlayStats, _stats_or_null
+from .polygon_geom import explode_geometries, gdf_bbox, _curve_keys
 
+try:  # shapely >= 2.0 ships vectorized geometry operations
+    from shapely import intersection as _intersection_v
+    from shapely import buffer as _buffer_v
+    from shapely import is_empty as _is_empty_v
+    from shapely import is_valid as _is_valid_v
+    from shapely import get_type_id as _type_id_v
+    from shapely import prepare as _prepare_v
+    from shapely import is_prepared as _is_prepared_v
+    from shapely import destroy_prepared as _destroy_prepared_v
+    from shapely import contains as _contains_v
+    from shapely import within as _within_v
+    from shapely import disjoint as _disjoint_v
+    from shapely import touches as _touches_v
+    from shapely import union_all as _union_all_v
+    from shapely import boundary as _boundary_v
+    from shapely import polygonize as _polygonize_v
+    from shapely import get_parts as _get_parts_v
+    from shapely import point_on_surface as _point_on_surface_v
+    from shapely import coverage_union_all as _coverage_union_all_v
+    from shapely import to_wkb as _to_wkb_v
+    from shapely import clip_by_rect as _clip_by_rect_v
+    from shapely import set_precision as _set_precision_v
+    from shapely import box as _box_v
+    from shapely import STRtree as _strtree_v
+except ImportError:
+    _intersection_v = _buffer_v = _is_empty_v = _is_valid_v = None
+    _type_id_v = _prepare_v = _contains_v = _within_v = _disjoint_v = _to_wkb_v = None
+    _clip_by_rect_v = _set_precision_v = _touches_v = _union_all_v = None
+    _boundary_v = _polygonize_v = _get_parts_v = _point_on_surface_v = None
+    _coverage_union_all_v = _box_v = _strtree_v = None
+    _is_prepared_v = _destroy_prepared_v = None
 
-def spatial_overlay(df1, df2, how='intersection', reproject=True, explode=False, keep_index=True, **kwargs):
+
+BATCH_SIZE = 10000
+
+# deepest split of the quadtree of a tiled overlay, see `_quadtree_tiles`
+MAX_TILE_DEPTH = 12
+
+# length of the linear units `grid_size` may be given in, in meters
+UNITS = {
+    'mm': 0.001,
+    'cm': 0.01,
+    'm': 1.0,
+    'km': 1000.0,
+    'ft': 0.3048,
+    'us-ft': 1200.0 / 3937.0,
+}
+
+# the operations of `spatial_overlay`, see `_check_how`
+HOWS = [
+    'intersection',
+    'union',
+    'identity',
+    'symmetric_difference',
+    'difference', 'erase',
+]
+
+
+def spatial_overlay(df1, df2, how='intersection', reproject=True, explode=False, keep_index=True,
+                    engine='cascade', n_jobs=1, executor=None, repair='all', stats=None,
+                    index_dir=None, tile_features=None, curve=None, grid_size=None,
+                    **kwargs):
     """Perform spatial overlay between two polygons.
     Currently only supports data GeoDataFrames with polygons.
     Implements several methods that are all effectively subsets of
@@ -20,19 +95,86 @@ def spatial_overlay(df1, df2, how='intersection', reproject=True, explode=False,
     Parameters
     ----------
     df1 : GeoDataFrame with MultiPolygon or Polygon geometry column
-    df2 : GeoDataFrame with MultiPolygon or Polygon geometry column
+    df2 : GeoDataFrame with MultiPolygon or Polygon geometry column, or
+        an `OverlayLayer` wrapping one to reuse its validated geometries,
+        spatial index and prepared geometries across calls.
     how : string
         Method of spatial overlay: 'intersection', 'union',
         'identity', 'symmetric_difference' or 'difference'.
-    reproject : boolean, default True
+    reproject : boolean or 'auto', default True
         If GeoDataFrames do not have same projection, reproject
         df2 to same projection of df1 before performing overlay.
+        Unless the output includes all of df2 ('union' and
+        'symmetric_difference'), only the geometries of df2 within the
+        bounding box of df1 are reprojected. With 'auto' the side with
+        fewer vertices to transform is reprojected instead: when that is
+        df1, the overlay runs in the projection of df2 and the result is
+        transformed back to the projection of df1.
     explode : boolean, optional (default=False)
-        explodes multipart geometries to single part.
+        explodes multipart geometries to single part. The parts are split
+        off the geometry arrays before the output frame is built.
     keep_index : boolean, optional (default=True)
         When combining geodataframes, this option assigns a range index to
         each dataframe prior to the merge operation to indicate the parent
         geometry in the source files.
+    engine : string, optional (default='cascade')
+        How geometries are subtracted for the difference based methods.
+        'cascade' unions all of the overlapping geometries of each row once
+        and subtracts the result in a single difference. 'reduce' subtracts
+        the overlapping geometries one at a time. 'polygonize' performs no
+        pairwise operations at all: the boundaries of the overlapping
+        geometries of both frames are noded once and polygonized into faces,
+        each face is labelled with its parents and the output geometries
+        are the faces dissolved by parents (see `flatten_overlaps`). It
+        pays off for the difference based methods on densely overlapping
+        layers, ignores `n_jobs` and orders each part of the output by its
+        parents.
+    n_jobs : int, optional (default=1)
+        Number of worker processes for the geometry operations. The
+        candidate pairs are split into chunks that are processed in a
+        `multiprocessing.Pool`; -1 uses all cores. Results are identical to
+        the serial path.
+    executor : object with a `map(func, iterable)` method, optional
+        e.g. a `concurrent.futures.ProcessPoolExecutor` or a
+        `multiprocessing.Pool` to run the chunks on. Takes precedence over
+        `n_jobs`.
+    repair : string or None, optional (default='all')
+        Which geometries are passed through `buffer(0)` to fix invalid
+        geometries. Only the invalid ones are ever repaired.
+        'input' repairs invalid geometries of `df1` and `df2` before the
+        overlay, 'output' repairs invalid results of the intersections and
+        differences, 'all' does both and None skips repair. Skipping repair
+        of invalid input may make shapely raise a topology error.
+    stats : OverlayStats, optional
+        collects the wall time of each stage of the overlay and counters
+        such as the number of candidate pairs, non-empty intersections,
+        discarded empty results and repaired geometries; see
+        `OverlayStats`. Nothing is collected when omitted.
+    index_dir : string, optional
+        directory in which the spatial index of `df2` is saved and from
+        which it is reloaded by later calls, see `OverlayLayer`.
+    tile_features : int, optional
+        overlay tile by tile: the combined extent of `df1` and `df2` is split
+        into a quadtree of tiles holding about `tile_features` features
+        each, both frames are clipped to every tile and the pieces that tile
+        edges cut out of one output geometry are merged back by their
+        parents in `df1` and `df2`. This bounds the size of every geometry
+        operation for large, dense layers. Tiles are independent and are
+        spread over the workers with `n_jobs` or `executor`.
+    curve : string, optional
+        work through the rows of `df1` in the order of a space filling
+        curve, 'hilbert' or 'morton' (see `spatial_keys`), so that each batch
+        of candidate pairs, and each chunk shipped to a worker, covers a
+        compact region of `df2`. Useful when the rows of `df1` are not
+        already spatially ordered. The output keeps its usual order.
+    grid_size : float or (float, string), optional
+        snap the coordinates of the inputs and of every intersection and
+        difference to a grid of this size, in the units of the crs of the
+        overlay or, as e.g. `(1, 'cm')`, in one of `UNITS`, converted with
+        `crs_units`. This removes the slivers and near-coincident edges of
+        layers digitized separately. With shapely >= 2 the snapped results
+        are valid by construction and `repair` is skipped; older versions
+        round the input coordinates only and still repair.
     kwargs : kward arguments for api compatibility with `geopandas.overlay`
 
     Returns
@@ -47,171 +189,2337 @@ def spatial_overlay(df1, df2, how='intersection', reproject=True, explode=False,
 
     """
 
-    # Allowed operations
-    allowed_hows = [
-        'intersection',
-        'union',
-        'identity',
-        'symmetric_difference',
-        'difference', 'erase',
-    ]
-
     # Error Messages
-    if how not in allowed_hows:
-        raise ValueError(
-            "`how` was {} but is expected to be in {}".format(
-                how, allowed_hows)
-        )
+    _check_how(how)
+    repair_input, repair_output = _check_repair(repair)
+    _check_engine(engine, ['cascade', 'reduce', 'polygonize'])
 
     if isinstance(df1, GeoSeries) or isinstance(df2, GeoSeries):
         raise NotImplementedError(
             "`spatial_overlay` currently only implemented for GeoDataFrames")
 
-    if (df1.geom_type.apply(lambda x: x in ['Polygon', 'MultiPolygon']).sum() != len(df1.index) or
-            df2.geom_type.apply(lambda x: x in ['Polygon', 'MultiPolygon']).sum() != len(df2.index)):
-        raise TypeError(
-            "`spatial_overlay` only takes GeoDataFrames with (multi)polygon geometries")
+    layer = df2 if isinstance(df2, OverlayLayer) else None
+    if layer is not None:
+        df2 = layer.df
+
+    meta1 = _check_polygons(df1)
+    meta2 = _check_polygons(df2) if layer is None else None
+
+    stats = _stats_or_null(stats)
+    start = time.time()
+    if layer is None and index_dir is not None:
+        layer = OverlayLayer(df2, repair=repair_input, stats=stats, index_dir=index_dir)
 
     if 'use_sindex' in kwargs:
         warnings.warn(
             '`use_sindex` is deprecated and will be ignored.', DeprecationWarning)
 
-    df1 = df1.copy()
-    df2 = df2.copy()
+    geoms1, geoms2, rows2, layer, crs, grid_size, repair_output = _prepare_inputs(
+        df1, df2, how, meta1, meta2, layer=layer, reproject=reproject, grid_size=grid_size,
+        repair_input=repair_input, repair_output=repair_output, stats=stats)
+
+    sindex2 = prepared2 = None
+    if layer is not None:
+        geoms2, sindex2, prepared2 = layer.geoms, layer.sindex, layer.prepared
+
+    pool = None
+    if executor is None and n_jobs != 1:
+        pool = executor = multiprocessing.Pool(n_jobs if n_jobs > 0 else None)
+
+    try:
+        df_out = _calculate_overlay(df1, df2, how=how, geoms1=geoms1, geoms2=geoms2,
+                                    keep_index=keep_index, engine=engine, executor=executor,
+                                    repair=repair_output, stats=stats, sindex2=sindex2,
+                                    prepared2=prepared2, rows2=rows2, crs=crs,
+                                    bounds1=_cached(meta1, geoms1, 'bounds'),
+                                    bounds2=_cached(meta2, geoms2, 'bounds'), explode=explode,
+                                    tile_features=tile_features, curve=curve,
+                                    grid_size=grid_size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if crs != df1.crs:
+        with stats.timer('reproject'):
+            df_out = df_out.to_crs(df1.crs)
+
+    stats.add_time('total', time.time() - start)
+    return df_out
+
+
+def spatial_overlay_files(path1, path2, out_path, how='intersection', layer1=None, layer2=None,
+                          out_layer=None, driver=None, batch_size=BATCH_SIZE, reproject=True,
+                          explode=False, keep_index=True, engine='cascade', repair='all',
+                          stats=None, grid_size=None):
+    """Perform a spatial overlay between two polygon files and write the
+    result to a third, streaming the features of the first file in batches.
+
+    The second file is read into memory and indexed once. The features of
+    the first file are read `batch_size` at a time with `fiona`, overlaid
+    against the second layer and written to `out_path` before the next
+    batch is read, so memory use is proportional to the batch size and the
+    size of the second layer, not to the size of the first layer or of the
+    output.
+
+    Parameters
+    ----------
+    path1 : string
+        path to the streamed polygon layer.
+    path2 : string
+        path to the polygon layer that is held in memory.
+    out_path : string
+        path of the file to write.
+    how : string
+        Method of spatial overlay: 'intersection', 'union',
+        'identity', 'symmetric_difference' or 'difference'.
+    layer1, layer2, out_layer : string, optional
+        layer names for multi-layer formats such as GeoPackage.
+    driver : string, optional
+        `fiona` driver of the output. Inferred from the extension of
+        `out_path` ('.shp', '.gpkg', '.geojson') or else taken from `path1`.
+    batch_size : int, optional
+        number of features of `path1` processed at a time.
+    reproject, explode, keep_index, engine, repair, stats, grid_size :
+        see `spatial_overlay`; `engine` is 'cascade' or 'reduce'. When
+        `keep_index` is True, `idx1` and `idx2` are the positions of the
+        features in `path1` and `path2`.
+
+    Returns
+    -------
+    out_path : string
+
+    Notes
+    -----
+    The records are written batch by batch, so their order differs from the
+    output of `spatial_overlay`. For 'union' and 'symmetric_difference' the
+    parts of the second layer not covered by the first are written last.
+
+    """
+
+    _check_how(how)
+    repair_input, repair_output = _check_repair(repair)
+    _check_engine(engine, ['cascade', 'reduce'])
+
+    # checked by the `OverlayLayer` below
+    df2 = geopandas.read_file(path2, layer=layer2)
+    with fiona.open(path2, layer=layer2) as src:
+        props2 = list(src.schema['properties'].items())
+
+    with fiona.open(path1, layer=layer1) as src:
+        crs = src.crs
+        if df2.crs != crs and reproject:
+            warnings.warn(
+                'Data has different projections.\n'
+                'Converted data to projection of first GeoPandas DataFrame.'
+            )
+            df2 = df2.to_crs(crs)
+
+        if keep_index:
+            df2['idx2'] = range(len(df2))
+        grid_size, repair_input, repair_output = _grid_repair(
+            grid_size, crs, repair_input, repair_output)
+        # indexed and prepared once for all of the batches
+        layer = OverlayLayer(df2, repair=repair_input, stats=stats, grid_size=grid_size)
+        geoms2 = layer.geoms
+
+        columns1 = list(src.schema['properties'])
+        props1 = list(src.schema['properties'].items())
+        if keep_index:
+            columns1.append('idx1')
+            props1.append(('idx1', 'int'))
+            props2.append(('idx2', 'int'))
+
+        schema = {
+            'geometry': 'Polygon' if explode else 'MultiPolygon',
+            'properties': _output_properties(props1, props2, how),
+        }
+        if driver is None:
+            driver = _DRIVERS.get(out_path.rsplit('.', 1)[-1].lower(), src.driver)
+
+        sink_kwargs = {'driver': driver, 'crs': crs, 'schema': schema}
+        if out_layer is not None:
+            sink_kwargs['layer'] = out_layer
+
+        remainder2 = geoms2.copy()
+        # the columns of `df2`'s remainders when `path1` has no features
+        df1 = GeoDataFrame(columns=columns1 + ['geometry'], geometry='geometry', crs=crs)
+        with fiona.open(out_path, 'w', **sink_kwargs) as sink:
+            offset = 0
+            for features in _batches(src, batch_size):
+                df1 = GeoDataFrame.from_features(features, crs=crs)
+                if keep_index:
+                    df1['idx1'] = range(offset, offset + len(features))
+                offset += len(features)
+
+                df1 = df1.loc[df1.geometry.notnull()].reindex(columns=columns1 + ['geometry'])
+                geoms1 = _check_polygons(df1).geoms
+                if grid_size is not None:
+                    geoms1 = _snap(geoms1, grid_size, stats)
+                if repair_input:
+                    geoms1 = _repair(geoms1, stats, 'repaired_input')
+                plan = _OverlayPlan(geoms1, geoms2, how=how, engine=engine,
+                                    repair=repair_output, stats=stats, sindex2=layer.sindex,
+                                    prepared2=layer.prepared, bounds2=layer.bounds,
+                                    grid_size=grid_size)
+                parts = plan.parts(remainder2=False)
+                df_out = _assemble(df1, df2, parts, crs=crs, explode=explode, stats=stats)
+                sink.writerecords(_records(df_out, schema))
+
+                if how == 'union':
+                    left, right, _ = plan.intersections
+                elif how == 'symmetric_difference':
+                    left, right = plan.left, plan.right
+                if how in ['union', 'symmetric_difference']:
+                    rows, inv = numpy.unique(right, return_inverse=True)
+                    order = numpy.argsort(inv, kind='mergesort')
+                    remainder2[rows] = _subtract_candidates(
+                        remainder2[rows], plan.geoms1, inv[order], left[order], engine=engine,
+                        repair=repair_output, stats=stats, grid_size=grid_size)
+
+            if how in ['union', 'symmetric_difference']:
+                keep = numpy.flatnonzero([not g.is_empty for g in remainder2])
+                parts = [(None, keep, remainder2[keep])]
+                df_out = _assemble(df1, df2, parts, crs=crs, explode=explode, stats=stats)
+                sink.writerecords(_records(df_out, schema))
+
+    return out_path
+
+
+def flatten_overlaps(gdf, repair=True, grid_size=None, stats=None):
+    """Splits a polygon layer whose polygons overlap into a planar partition:
+    non-overlapping faces, each with the list of the polygons it lies in.
+
+    The boundaries of all polygons are noded together once and polygonized
+    into faces, and every face is labelled with its parents by looking up a
+    point inside it in the spatial index of the layer. Unlike
+    `spatial_overlay(gdf, gdf, how='union')` no pair of polygons is
+    overlaid and no face is produced twice, so the cost grows with the
+    total number of vertices rather than with the number of overlapping
+    pairs.
+
+    Parameters
+    ----------
+    gdf : GeoDataFrame
+        polygon layer.
+    repair : boolean, optional (default=True)
+        pass the invalid polygons through `buffer(0)` first.
+    grid_size : float, optional
+        node the boundaries on a grid of this size in the units of the crs,
+        see `spatial_overlay`.
+    stats : OverlayStats, optional
+        times the stages 'node', 'polygonize' and 'label'.
+
+    Returns
+    -------
+    GeoDataFrame
+        one row per face, with the columns `parents` (a tuple of the
+        positions in `gdf` of the polygons containing the face) and
+        `n_parents`. Gaps enclosed by polygons belong to no polygon and are
+        left out. Rows are ordered by their parents.
+
+    Examples
+    --------
+    >>> permits = read_file('permits.shp')  # doctest: +SKIP
+    >>> faces = flatten_overlaps(permits)  # doctest: +SKIP
+    >>> faces[faces['n_parents'] > 1]  # doctest: +SKIP
+
+    """
+    if isinstance(gdf, GeoSeries):
+        raise NotImplementedError(
+            "`flatten_overlaps` currently only implemented for GeoDataFrames")
+    metadata = _check_polygons(gdf)
+    stats = _stats_or_null(stats)
+
+    geoms = metadata.geoms
+    if grid_size is not None:
+        grid_size = _grid_size(grid_size, gdf.crs)
+        geoms = _snap(geoms, grid_size, stats)
+    elif repair:
+        geoms = _repair(geoms, stats, 'repaired_input', metadata.valid)
+
+    faces = _polygonize_boundaries(geoms, grid_size, stats)
+    with stats.timer('label'):
+        face_rows, parents = _label_faces(faces, geoms)
+
+    keep = numpy.unique(face_rows)
+    groups = _group_pairs(numpy.searchsorted(keep, face_rows), parents, len(keep))
+    labels = [tuple(int(p) for p in numpy.sort(g)) for g in groups]
+    order = sorted(range(len(keep)), key=labels.__getitem__)
+
+    data = OrderedDict()
+    data['parents'] = [labels[i] for i in order]
+    data['n_parents'] = numpy.array([len(labels[i]) for i in order], dtype=numpy.intp)
+    data['geometry'] = faces[keep[order]]
+    stats.count('output_rows', len(keep))
+    return GeoDataFrame(pandas.DataFrame(data), geometry='geometry', crs=gdf.crs)
+
+
+def multi_overlay(layers, how='intersection', reproject=True, explode=False, engine='cascade',
+                  repair='all', stats=None, grid_size=None):
+    """Perform a spatial overlay of a sequence of polygon layers, e.g.
+    parcels, zoning, flood zones and soils, in one call.
+
+    The layers are still overlaid two at a time, but between the steps the
+    result is only kept as an array of geometries and, for each of them,
+    the positions of its parents in the layers joined so far (its
+    provenance). Every step queries the spatial index of an original layer,
+    built once, instead of indexing the growing intermediate frame, and the
+    attribute columns of all layers are gathered once at the end.
+
+    The layers are joined in the order that keeps the intermediate result
+    small: starting from the pair of layers with the fewest overlapping
+    pairs, each step adds the layer with the fewest overlapping pairs with
+    the layers joined so far (the smallest for an intersection, the sum
+    otherwise). The overlapping pairs are estimated from a sample of the
+    bounds of each layer.
+
+    Parameters
+    ----------
+    layers : sequence of GeoDataFrames or OverlayLayers
+        at least two polygon layers. The output is in the crs of the first.
+    how : string
+        'intersection' (the parts covered by every layer), 'union' (the
+        parts covered by any layer) or 'identity' (all of the first layer,
+        split by every other layer).
+    reproject, explode, engine, repair, stats, grid_size :
+        see `spatial_overlay`. `stats` times the join order as 'plan'.
+
+    Returns
+    -------
+    GeoDataFrame
+        the attribute columns of every layer and, after the columns of the
+        k-th layer, `idx<k>` with the position of the parent in that layer,
+        NaN for the parts outside of it. Column names shared by several
+        layers get the suffix of their layer ('_1', '_2', ...). Rows are
+        ordered by their parents in the order of `layers`.
+
+    Examples
+    --------
+    >>> layers = [read_file(p) for p in ['parcels.shp', 'zoning.shp', 'flood.shp']]  # doctest: +SKIP
+    >>> df = multi_overlay(layers, how='identity')  # doctest: +SKIP
+
+    """
+    layers = list(layers)
+    if len(layers) < 2:
+        raise ValueError('`multi_overlay` needs at least two layers')
+    _check_how(how, ['intersection', 'union', 'identity'])
+    repair_input, repair_output = _check_repair(repair)
+    _check_engine(engine, ['cascade', 'reduce', 'polygonize'])
+
+    if any(isinstance(layer, GeoSeries) for layer in layers):
+        raise NotImplementedError(
+            "`multi_overlay` currently only implemented for GeoDataFrames")
+
+    stats = _stats_or_null(stats)
+    start = time.time()
+    frames = [layer.df if isinstance(layer, OverlayLayer) else layer for layer in layers]
+    crs = frames[0].crs
+    if reproject and any(df.crs != crs for df in frames):
+        warnings.warn(
+            'Data has different projections.\n'
+            'Converted data to projection of first GeoPandas DataFrame.'
+        )
+
+    grid_size, repair_input, repair_output = _grid_repair(
+        grid_size, crs, repair_input, repair_output)
+    layers = [_as_layer(layer, crs if reproject else None, repair_input, grid_size, stats)
+              for layer in layers]
+
+    with stats.timer('plan'):
+        order = _join_order(layers, how)
+
+    geoms = layers[order[0]].geoms
+    provenance = numpy.arange(len(geoms), dtype=numpy.intp)[:, None]
+    for k in order[1:]:
+        layer = layers[k]
+        parts = _overlay_parts(geoms, layer.geoms, how, engine=engine, repair=repair_output,
+                               stats=stats, sindex2=layer.sindex, prepared2=layer.prepared,
+                               bounds2=layer.bounds, grid_size=grid_size)
+        geoms, provenance = _stack_provenance(parts, provenance)
+
+    provenance = provenance[:, numpy.argsort(order)]
+    keys = numpy.where(provenance < 0, numpy.iinfo(numpy.intp).max, provenance)
+    rows = numpy.lexsort(keys.T[::-1])
+    geoms, provenance = geoms[rows], provenance[rows]
+
+    if explode:
+        with stats.timer('explode'):
+            geoms, parents = explode_geometries(geoms)
+            provenance = provenance[parents]
+
+    with stats.timer('assemble'):
+        df = _gather_layers(frames, provenance, geoms, crs)
+    stats.count('output_rows', len(df))
+    stats.add_time('total', time.time() - start)
+    return df
+
+
+def tabulate_intersection(df1, df2, measure='area', reproject=True, sparse=False,
+                          repair='all', stats=None, grid_size=None):
+    """Measures the intersection of every overlapping pair of rows of `df1`
+    and `df2` without building the overlay, e.g. for area weighted
+    apportionment (see `apportion`).
+
+    The candidate pairs come from the same index query as
+    `spatial_overlay`, and pairs where one geometry lies within the other
+    are measured without an intersection. The other pairs are intersected
+    `BATCH_SIZE` at a time and only the measure of each intersection is
+    kept, so neither the intersections nor their attributes are ever held
+    all at once.
+
+    Parameters
+    ----------
+    df1 : GeoDataFrame
+        polygons, or with `measure='length'` (multi)linestrings.
+    df2 : GeoDataFrame with MultiPolygon or Polygon geometry column, or an
+        `OverlayLayer`
+    measure : string, optional (default='area')
+        'area' of the intersection of two polygons, or 'length' of the part
+        of each line of `df1` that lies in a polygon of `df2`.
+    reproject : boolean, optional (default=True)
+        reproject `df2` to the crs of `df1` first if they differ. The
+        measures are in the units of the crs of `df1`.
+    sparse : boolean, optional (default=False)
+        return a `scipy.sparse.csr_matrix` of shape (len(df1), len(df2))
+        instead of the arrays. Requires scipy.
+    repair, stats, grid_size :
+        see `spatial_overlay`.
+
+    Returns
+    -------
+    idx1, idx2 : 1-D integer arrays
+        positions into `df1` and `df2` of every pair with a non-zero
+        measure, sorted by `idx1`.
+    values : 1-D float array
+        the measure of the intersection of each pair.
+
+    Examples
+    --------
+    >>> idx1, idx2, area = tabulate_intersection(blocks, service_areas)  # doctest: +SKIP
+    >>> fraction = area / blocks.area.values[idx1]  # doctest: +SKIP
+
+    """
+    _check_option('measure', measure, ['area', 'length'])
+    repair_input, repair_output = _check_repair(repair)
+
+    if isinstance(df1, GeoSeries) or isinstance(df2, GeoSeries):
+        raise NotImplementedError(
+            "`tabulate_intersection` currently only implemented for GeoDataFrames")
+
+    layer = df2 if isinstance(df2, OverlayLayer) else None
+    meta2 = None
+    if layer is not None:
+        df2 = layer.df
+    else:
+        meta2 = _check_polygons(df2)
+    if measure == 'area':
+        meta1 = _check_polygons(df1)
+    else:
+        meta1 = geometry_metadata(df1)
+        if not meta1.is_lineal().all():
+            raise TypeError(
+                "`tabulate_intersection` with `measure='length'` only takes (multi)linestring "
+                "geometries in `df1`")
+
+    stats = _stats_or_null(stats)
+    start = time.time()
+    geoms1, geoms2, rows2, layer, _, grid_size, repair_output = _prepare_inputs(
+        df1, df2, 'intersection', meta1, meta2, layer=layer, reproject=bool(reproject),
+        grid_size=grid_size, repair_input=repair_input, repair_output=repair_output,
+        stats=stats, repair1=measure == 'area')
+
+    sindex2 = prepared2 = None
+    if layer is not None:
+        geoms2, sindex2, prepared2 = layer.geoms, layer.sindex, layer.prepared
+
+    plan = _OverlayPlan(geoms1, geoms2, stats=stats, sindex2=sindex2, prepared2=prepared2,
+                        bounds1=_cached(meta1, geoms1, 'bounds'),
+                        bounds2=_cached(meta2, geoms2, 'bounds'), grid_size=grid_size)
+    with stats.timer('intersection'):
+        idx1, idx2, values = _measure_kernel(
+            geoms1, geoms2, plan.left, plan.right, measure=measure, repair=repair_output,
+            stats=stats, prepared=prepared2, grid_size=grid_size)
+    stats.count('intersections', len(idx1))
+    if rows2 is not None:
+        idx2 = rows2[idx2]
+    stats.add_time('total', time.time() - start)
+
+    if sparse:
+        import scipy.sparse
+        return scipy.sparse.csr_matrix((values, (idx1, idx2)), shape=(len(df1), len(df2)))
+    return idx1, idx2, values
+
+
+def apportion(df1, df2, columns, table=None, **kwargs):
+    """Distributes the numeric `columns` of `df1` over the rows of `df2` in
+    proportion to the share of the area of each row of `df1` that lies in
+    each row of `df2`, e.g. the population of census blocks over service
+    areas.
+
+    Parameters
+    ----------
+    df1 : GeoDataFrame
+    df2 : GeoDataFrame or OverlayLayer
+    columns : list of string
+        numeric columns of `df1`. Missing values count as 0.
+    table : tuple of (idx1, idx2, values) arrays or sparse matrix, optional
+        the result of `tabulate_intersection(df1, df2, **kwargs)`, computed
+        if not given.
+    **kwargs :
+        passed to `tabulate_intersection`. With `measure='length'` the
+        shares are those of the length of the lines of `df1`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the apportioned sums of `columns`, with the index of `df2`. The
+        parts of `df1` outside of `df2` are not apportioned.
+
+    """
+    if table is None:
+        table = tabulate_intersection(df1, df2, **kwargs)
+    if hasattr(table, 'tocoo'):
+        table = table.tocoo()
+        table = table.row, table.col, table.data
+    idx1, idx2, values = table
+
+    df2 = df2.df if isinstance(df2, OverlayLayer) else df2
+    geoms1 = geometry_metadata(df1).geoms
+    totals = _length(geoms1) if kwargs.get('measure') == 'length' else _area(geoms1)
+    totals = totals[idx1]
+    share = numpy.divide(values, totals, out=numpy.zeros(len(values)), where=totals > 0)
+
+    data = OrderedDict()
+    for column in columns:
+        weights = numpy.nan_to_num(df1[column].values.astype(float))[idx1] * share
+        data[column] = numpy.bincount(idx2, weights=weights, minlength=len(df2))
+    return pandas.DataFrame(data, index=df2.index, columns=columns)
+
+
+def update_overlay(previous, df1, df2, how='intersection', changed1=None, changed2=None,
+                   **kwargs):
+    """Brings the result of an earlier overlay up to date with the changes
+    to its inputs, recomputing only the output rows that the changes can
+    affect.
 
+    An intersection row depends only on its two parents, and the remainder
+    of a row (the part covered by no row of the other frame) on the row
+    and the rows of the other frame that overlap it. So the output rows of
+    the changed rows are dropped, and so are the remainders of their
+    neighbours: the rows they overlapped before the change, found from the
+    provenance of the intersection rows of `previous`, and the rows their
+    new geometries overlap, found from the bounds. Those rows are then
+    overlaid again against the rows of the other frame near them.
+
+    Parameters
+    ----------
+    previous : GeoDataFrame or None
+        the result of an earlier `update_overlay`, or of `spatial_overlay`
+        with `keep_index=True` on two frames with a RangeIndex, i.e. with
+        the columns `idx1` and `idx2` holding the index labels of the
+        parents of every row in `df1` and `df2`. None computes the full
+        overlay.
+    df1, df2 : GeoDataFrame
+        the inputs as they are now. Rows are identified by their index
+        label, which must be unique and must not be reused for different
+        features.
+    how : string
+        'intersection', 'identity' or 'union'. The output of the other
+        methods does not record which rows overlapped, so it cannot be
+        updated.
+    changed1, changed2 : sequence of index labels, optional
+        the rows of `df1` and `df2` added, modified or removed since
+        `previous` was computed.
+    **kwargs :
+        passed to `spatial_overlay`, and should be the same as for
+        `previous`. `keep_index` is always True.
+
+    Returns
+    -------
+    GeoDataFrame
+        the rows of `previous` that are still valid followed by the
+        recomputed ones, with the columns of `previous` and a new range
+        index.
+
+    Examples
+    --------
+    >>> result = update_overlay(None, parcels, zoning, how='identity')  # doctest: +SKIP
+    >>> result = update_overlay(result, parcels, zoning, how='identity',  # doctest: +SKIP
+    ...                         changed2=edited_zones)
+
+    """
+    _check_how(how, ['intersection', 'identity', 'union'])
+    kwargs['keep_index'] = True
+
+    if previous is None:
+        df = spatial_overlay(df1, df2, how=how, **kwargs)
+        df['idx1'] = _labels(df['idx1'], df1.index)
+        df['idx2'] = _labels(df['idx2'], df2.index)
+        return df
+
+    if not set(['idx1', 'idx2']).issubset(previous.columns):
+        raise ValueError('`previous` has no `idx1` and `idx2` columns, see `keep_index`')
+
+    changed1 = pandas.Index([] if changed1 is None else list(changed1)).unique()
+    changed2 = pandas.Index([] if changed2 is None else list(changed2)).unique()
+    present1 = changed1[changed1.isin(df1.index)]
+    present2 = changed2[changed2.isin(df2.index)]
+
+    # the rows whose remainder has to be recomputed
+    dirty1, dirty2 = pandas.Index(present1), pandas.Index(present2)
+    paired = previous['idx1'].notnull() & previous['idx2'].notnull()
+    neighbours1 = df1.index[_rows_near(df1, df2.loc[present2])]
+    if how in ['identity', 'union']:
+        before = previous.loc[paired & previous['idx2'].isin(changed2), 'idx1']
+        dirty1 = dirty1.union(neighbours1).union(df1.index[df1.index.isin(before)])
+    if how == 'union':
+        neighbours2 = df2.index[_rows_near(df2, df1.loc[present1])]
+        before = previous.loc[paired & previous['idx1'].isin(changed1), 'idx2']
+        dirty2 = dirty2.union(neighbours2).union(df2.index[df2.index.isin(before)])
+
+    stale = previous['idx1'].isin(changed1) | previous['idx2'].isin(changed2)
+    stale |= ~paired & previous['idx1'].isin(dirty1)
+    stale |= ~paired & previous['idx2'].isin(dirty2)
+    parts = [previous.loc[~stale]]
+
+    # every intersection of a changed row is found from its side of df1
+    rows1 = present1.union(neighbours1).union(dirty1)
+    if len(rows1):
+        sub1 = df1.loc[rows1]
+        sub2 = df2.iloc[_rows_near(df2, sub1)]
+        df = spatial_overlay(sub1, sub2, how='intersection' if how == 'intersection' else
+                             'identity', **kwargs)
+        df['idx1'] = _labels(df['idx1'], sub1.index)
+        df['idx2'] = _labels(df['idx2'], sub2.index)
+        fresh = df['idx1'].isin(changed1) | df['idx2'].isin(changed2)
+        parts.append(df.loc[fresh | (df['idx2'].isnull() & df['idx1'].isin(dirty1))])
+
+    if how == 'union' and len(dirty2):
+        sub2 = df2.loc[dirty2]
+        sub1 = df1.iloc[_rows_near(df1, sub2)]
+        df = spatial_overlay(sub2, sub1, how='difference', **kwargs)
+        df = df.rename(columns={'idx1': 'idx2'})
+        df['idx2'] = _labels(df['idx2'], sub2.index)
+        parts.append(df)
+
+    df = pandas.concat(parts, ignore_index=True).reindex(columns=previous.columns)
+    return GeoDataFrame(df, geometry=previous.geometry.name, crs=previous.crs)
+
+
+class OverlayLayer(object):
+    """A polygon GeoDataFrame prepared once for repeated overlays, to be
+    passed as `df2` to `spatial_overlay`.
+
+    The geometry types are checked, the invalid geometries repaired and the
+    bounds, spatial index and prepared geometries built when the layer is
+    created, so that each overlay against it only costs the index query and
+    the geometry work for the other frame.
+
+    Parameters
+    ----------
+    df : GeoDataFrame with MultiPolygon or Polygon geometry column
+        the frame is referenced, not copied, and should not be modified
+        while the layer is in use.
+    repair : boolean, optional (default=True)
+        pass the invalid geometries through `buffer(0)`. This takes the
+        place of the input repair of `spatial_overlay` for this layer.
+    stats : OverlayStats, optional
+        counts the repairs as 'repaired_input'.
+    index_dir : string, optional
+        directory in which the spatial index is saved, in files named after
+        a hash of the content of the geometries. A layer with the same
+        geometries, e.g. in a later process, loads the saved files instead
+        of recomputing them; a layer whose geometries have changed gets new
+        files. Stale files are not removed. With shapely >= 2 only the
+        bounds are saved and the index is an STRtree bulk loaded from them,
+        so that it is queried in bulk like any other; otherwise the rtree
+        index itself is saved, and queried one row at a time under numpy <
+        2 (see `_saved_sindex`).
+    grid_size : float, optional
+        snap the geometries to a grid of this size in the units of the crs
+        of the layer once, see `spatial_overlay`. Overlays with the same
+        `grid_size` use the layer as is; others snap and index a copy.
+
+    Attributes
+    ----------
+    df : GeoDataFrame
+    crs : dict
+    geoms : 1-D object array of the (repaired) geometries
+    bounds : (n, 4) float array
+    sindex : spatial index with positional ids, see `_build_sindex`
+    prepared : dict of prepared geometries by position, or None where
+        shapely prepares `geoms` in place (shapely >= 2)
+
+    Examples
+    --------
+    >>> zoning = OverlayLayer(read_file('zoning.shp'))  # doctest: +SKIP
+    >>> for parcels in requests:  # doctest: +SKIP
+    ...     spatial_overlay(parcels, zoning, how='intersection')
+
+    """
+
+    def __init__(self, df, repair=True, stats=None, index_dir=None, grid_size=None):
+        if isinstance(df, GeoSeries):
+            raise NotImplementedError(
+                "`OverlayLayer` currently only implemented for GeoDataFrames")
+        metadata = _check_polygons(df)
+
+        self.df = df
+        self.crs = df.crs
+        self.repair = repair
+        self.index_dir = index_dir
+        self.grid_size = grid_size
+        self.geoms = metadata.geoms
+        if grid_size is not None:
+            self.geoms = _snap(self.geoms, grid_size, stats)
+        if repair and (grid_size is None or _set_precision_v is None):
+            self.geoms = _repair(self.geoms, stats, 'repaired_input',
+                                 _cached(metadata, self.geoms, 'valid'))
+        bounds = _cached(metadata, self.geoms, 'bounds')
+        if index_dir is None:
+            self.bounds = _bounds(self.geoms) if bounds is None else bounds
+            with _stats_or_null(stats).timer('index'):
+                self.sindex = _build_sindex(self.bounds)
+        else:
+            with _stats_or_null(stats).timer('index'):
+                self.bounds, self.sindex = _saved_sindex(self.geoms, index_dir, bounds)
+
+        if _prepare_v is not None:
+            _prepare_v(self.geoms)
+            self.prepared = None
+        else:
+            self.prepared = dict(
+                (i, prep(g)) for i, g in enumerate(self.geoms) if not g.is_empty)
+        self._projections = {}
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def to_crs(self, crs):
+        """Returns the layer reprojected to `crs`. The reprojected layer is
+        built once per crs and reused.
+        """
+        key = str(crs)
+        if key not in self._projections:
+            self._projections[key] = OverlayLayer(
+                self.df.to_crs(crs), repair=self.repair, index_dir=self.index_dir,
+                grid_size=self.grid_size)
+        return self._projections[key]
+
+
+_DRIVERS = {'shp': 'ESRI Shapefile', 'gpkg': 'GPKG', 'geojson': 'GeoJSON', 'json': 'GeoJSON'}
+
+
+def _batches(features, batch_size):
+    """Yields lists of at most `batch_size` items from `features`."""
+    batch = []
+    for feature in features:
+        batch.append(feature)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _output_properties(props1, props2, how):
+    """Returns the `fiona` schema properties of the overlay of two layers with
+    the (name, type) properties `props1` and `props2`, using the same column
+    naming as `_assemble`.
+    """
+    names1 = set(name for name, _ in props1)
+    names2 = set(name for name, _ in props2)
+    joined = (
+        [('{}_1'.format(n) if n in names2 else n, t) for n, t in props1] +
+        [('{}_2'.format(n) if n in names1 else n, t) for n, t in props2]
+    )
+
+    parts = {
+        'intersection': [joined],
+        'difference': [props1],
+        'erase': [props1],
+        'identity': [props1, joined],
+        'symmetric_difference': [props1, props2],
+        'union': [joined, props1, props2],
+    }[how]
+
+    properties = OrderedDict()
+    for part in parts:
+        for name, prop_type in part:
+            properties.setdefault(name, prop_type)
+    return properties
+
+
+def _records(df, schema):
+    """Yields `fiona` records for the rows of an overlay result, promoting
+    polygons to multipolygons when the schema asks for those.
+    """
+    names = list(schema['properties'])
+    columns = [c for c in names if c in df.columns]
+    for row, geom in zip(df[columns].itertuples(index=False), df.geometry.values):
+        properties = dict.fromkeys(names)
+        for name, value in zip(columns, row):
+            if isinstance(value, numpy.generic):
+                value = value.item()
+            properties[name] = None if pandas.isnull(value) else value
+
+        if schema['geometry'] == 'MultiPolygon' and geom.geom_type == 'Polygon':
+            geom = MultiPolygon([geom])
+        yield {'geometry': mapping(geom), 'properties': properties}
+
+
+def _check_how(how, allowed_hows=HOWS):
+    _check_option('how', how, allowed_hows)
+
+
+def _check_engine(engine, allowed_engines):
+    _check_option('engine', engine, allowed_engines)
+
+
+def _check_option(name, value, allowed):
+    """Raises a ValueError unless the argument `name` is one of `allowed`."""
+    if value not in allowed:
+        raise ValueError(
+            "`{}` was {} but is expected to be in {}".format(
+                name, value, allowed)
+        )
+
+
+def _check_polygons(df, metadata=None):
+    """Raises a TypeError unless all geometries of `df` are (multi)polygons
+    and returns the `GeometryMetadata` of `df` (looked up if not given).
+    """
+    if metadata is None:
+        metadata = geometry_metadata(df)
+    if not metadata.is_polygonal().all():
+        raise TypeError(
+            "`spatial_overlay` only takes GeoDataFrames with (multi)polygon geometries")
+    return metadata
+
+
+def _prepare_inputs(df1, df2, how, meta1, meta2=None, layer=None, reproject=True,
+                    grid_size=None, repair_input=True, repair_output=True, stats=None,
+                    repair1=True):
+    """The geometries of `df1` and `df2` ready to be overlaid: brought into
+    a common crs (see `_align_crs`), snapped to `grid_size` and with the
+    invalid geometries repaired if `repair_input`. `df2` is given either
+    with its `GeometryMetadata` `meta2` or as the `OverlayLayer` `layer`,
+    which is rebuilt if its grid differs. With `repair1=False` the
+    geometries of `df1` are not repaired.
+
+    Returns
+    -------
+    geoms1, geoms2, rows2, layer, crs :
+        see `_align_crs`; `geoms2` is None with a `layer`.
+    grid_size, repair_output :
+        see `_grid_repair`.
+
+    """
+    stats = _stats_or_null(stats)
+    geoms1 = meta1.geoms
+    geoms2 = rows2 = None
+    crs = df1.crs
     if df1.crs != df2.crs and reproject:
         warnings.warn(
             'Data has different projections.\n'
             'Converted data to projection of first GeoPandas DataFrame.'
         )
-        df2.to_crs(crs=df1.crs, inplace=True)
+        with stats.timer('reproject'):
+            geoms1, geoms2, rows2, layer, crs = _align_crs(
+                df1, df2, how, geoms1, layer=layer, auto=reproject == 'auto',
+                meta1=meta1, meta2=meta2)
+    elif layer is None:
+        geoms2 = meta2.geoms
+
+    grid_size, repair_input, repair_output = _grid_repair(
+        grid_size, crs, repair_input, repair_output)
+    if grid_size is not None:
+        geoms1 = _snap(geoms1, grid_size, stats)
+        if layer is None:
+            geoms2 = _snap(geoms2, grid_size, stats)
+        elif layer.grid_size != grid_size:
+            layer = OverlayLayer(layer.df, repair=layer.repair, stats=stats, grid_size=grid_size)
+
+    if repair_input:
+        if repair1:
+            geoms1 = _repair(geoms1, stats, 'repaired_input', _cached(meta1, geoms1, 'valid'))
+        if layer is None:
+            geoms2 = _repair(geoms2, stats, 'repaired_input', _cached(meta2, geoms2, 'valid'))
+    return geoms1, geoms2, rows2, layer, crs, grid_size, repair_output
+
+
+def _align_crs(df1, df2, how, geoms1, layer=None, auto=False, meta1=None, meta2=None):
+    """Brings the geometries of `df1` and `df2` into a common crs.
+
+    By default `df2` is reprojected to the crs of `df1`. Unless the output
+    of `how` contains the remainder of `df2`, only the geometries of `df2`
+    whose bounds meet the bounding box of `df1`, reprojected to the crs of
+    `df2`, are transformed. With `auto`, `df1` is reprojected to the crs of
+    `df2` instead when that transforms fewer vertices, counting the output
+    that has to be transformed back as about twice the vertices of `df1`.
+    `meta1` and `meta2` are the `GeometryMetadata` of the frames when
+    already looked up.
+
+    Returns
+    -------
+    geoms1, geoms2 : 1-D object arrays of the geometries in the common crs
+    rows2 : 1-D integer array or None
+        positions into `df2` of `geoms2`, None when `geoms2` holds all of
+        `df2`.
+    layer : OverlayLayer or None
+        `layer` in the common crs.
+    crs : the common crs
+
+    """
+    all_of_df2 = how in ['union', 'symmetric_difference']
+    rows2 = None
+    if meta2 is None and layer is None:
+        meta2 = geometry_metadata(df2)
 
+    if layer is not None:
+        geoms2 = layer.geoms
+        reproject_df2 = not auto or str(df1.crs) in layer._projections
     else:
-        df2.crs = df1.crs
+        geoms2, counts2 = meta2.geoms, None
+        if not all_of_df2:
+            rows2 = _overlapping_rows(df1, meta2.bounds, df2.crs)
+            geoms2 = geoms2[rows2]
+        reproject_df2 = not auto
 
-    if keep_index:
-        df1['idx1'] = range(len(df1))
-        df2['idx2'] = range(len(df2))
+    if auto and not reproject_df2:
+        if layer is None:
+            counts2 = meta2.vertex_counts
+            counts2 = counts2 if rows2 is None else counts2[rows2]
+        else:
+            counts2 = _vertex_counts(geoms2)
+        cost2 = counts2.sum()
+        if meta1 is None:
+            meta1 = geometry_metadata(df1)
+        cost1 = 2 * meta1.vertex_counts.sum()
+        if all_of_df2:
+            cost1 += cost2
+        reproject_df2 = cost2 <= cost1
 
-    for df in [df1, df2]:
-        if 'geometry' != df.geometry.name:
-            if 'geometry' in df.columns:
-                df.drop('geometry', axis=1, inplace=True)
-            df.rename(columns={df.geometry.name: 'geometry'}, inplace=True)
-            df.set_geometry('geometry', inplace=True)
+    if not reproject_df2:
+        geoms1 = _object_array(GeoSeries(geoms1, crs=df1.crs).to_crs(df2.crs).values)
+        return geoms1, geoms2, rows2, layer, df2.crs
 
-        if not all(df.geometry.is_valid):
-            df.geometry = df.geometry.buffer(0)
+    if layer is not None:
+        return geoms1, None, None, layer.to_crs(df1.crs), df1.crs
 
-    df_out = _calculate_overlay(df1, df2, how=how)
+    geoms2 = _object_array(GeoSeries(geoms2, crs=df2.crs).to_crs(df1.crs).values)
+    return geoms1, geoms2, rows2, None, df1.crs
 
-    if explode:
-        return explode_multipart_polygons(df_out)
 
-    return df_out
+def _overlapping_rows(df1, bounds2, crs2, densify=20, pad=0.01):
+    """Returns the positions of the rows of the (n, 4) array `bounds2` (in
+    the crs `crs2`) that meet the bounding box of `df1` reprojected to
+    `crs2`. The box is densified and padded by the fraction `pad` of its
+    size so that it covers the curved image of its edges.
+    """
+    box = gdf_bbox(df1, densify=densify).to_crs(crs2)
+    minx, miny, maxx, maxy = box.total_bounds
+    if not numpy.isfinite([minx, miny, maxx, maxy]).all():
+        return numpy.arange(len(bounds2))
+
+    dx, dy = (maxx - minx) * pad, (maxy - miny) * pad
+    hits = ((bounds2[:, 0] <= maxx + dx) & (bounds2[:, 2] >= minx - dx) &
+            (bounds2[:, 1] <= maxy + dy) & (bounds2[:, 3] >= miny - dy))
+    return numpy.flatnonzero(hits)
+
+
+def _cached(metadata, geoms, name):
+    """Returns the attribute `name` of the `GeometryMetadata` `metadata` if
+    it describes the array `geoms` (i.e. `geoms` were not reprojected,
+    repaired or subset since), else None.
+    """
+    if metadata is None or geoms is not metadata.geoms:
+        return None
+    return getattr(metadata, name)
 
 
-def _calculate_overlay(df1, df2, how):
+def _check_repair(repair):
+    """Returns the (repair_input, repair_output) flags of a `repair` mode."""
+    _check_option('repair', repair, ['all', 'input', 'output', None])
+    return repair in ['all', 'input'], repair in ['all', 'output']
+
+
+def _repair(geoms, stats=None, counter='repaired', valid=None):
+    """Returns a copy of the array `geoms` with only its invalid geometries
+    passed through `buffer(0)`, or `geoms` itself if all of them are valid.
+    The number of repaired geometries is added to `stats` under `counter`.
+    `valid` is the validity of `geoms` when it is already known.
+    """
+    stats = _stats_or_null(stats)
+    with stats.timer('repair'):
+        if valid is not None:
+            invalid = ~valid
+        elif _is_valid_v is not None:
+            invalid = ~_is_valid_v(geoms)
+        else:
+            invalid = numpy.array([not g.is_valid for g in geoms], dtype=bool)
+
+        n = int(invalid.sum())
+        if n:
+            geoms = _object_array(geoms).copy()
+            if _buffer_v is not None:
+                geoms[invalid] = _buffer_v(geoms[invalid], 0)
+            else:
+                geoms[invalid] = _object_array([g.buffer(0) for g in geoms[invalid]])
+    stats.count(counter, n)
+    return geoms
+
+
+def _as_layer(layer, crs=None, repair=True, grid_size=None, stats=None):
+    """Returns the GeoDataFrame or `OverlayLayer` `layer` as an
+    `OverlayLayer` in `crs` (unless None) snapped to `grid_size`.
+    """
+    if not isinstance(layer, OverlayLayer):
+        if crs is not None and layer.crs != crs:
+            with _stats_or_null(stats).timer('reproject'):
+                layer = layer.to_crs(crs)
+        return OverlayLayer(layer, repair=repair, stats=stats, grid_size=grid_size)
+
+    if crs is not None and layer.crs != crs:
+        with _stats_or_null(stats).timer('reproject'):
+            layer = layer.to_crs(crs)
+    if layer.grid_size != grid_size:
+        layer = OverlayLayer(layer.df, repair=layer.repair, stats=stats, grid_size=grid_size)
+    return layer
+
+
+def _join_order(layers, how, sample=1000):
+    """Returns the order in which `multi_overlay` joins the `OverlayLayer`s
+    `layers`, see there. The first layer always comes first for 'identity'.
+    """
+    n = len(layers)
+    pairs = numpy.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            a, b = (i, j) if len(layers[i]) <= len(layers[j]) else (j, i)
+            pairs[i, j] = pairs[j, i] = _estimate_pairs(
+                layers[a].bounds, layers[b].sindex, sample)
+
+    if how == 'identity':
+        order = [0]
+    else:
+        order = list(min(((i, j) for i in range(n) for j in range(i + 1, n)),
+                         key=lambda ij: pairs[ij]))
+
+    reduce_pairs = numpy.min if how == 'intersection' else numpy.sum
+    while len(order) < n:
+        rest = [k for k in range(n) if k not in order]
+        order.append(min(rest, key=lambda k: reduce_pairs(pairs[order, k])))
+    return order
+
+
+def _estimate_pairs(bounds, sindex, sample=1000):
+    """Estimates the number of candidate pairs of the (n, 4) array `bounds`
+    in `sindex` from an evenly spaced sample of at most about `sample` rows.
+    """
+    if not len(bounds):
+        return 0.0
+    step = max(len(bounds) // sample, 1)
+    left, _ = _candidate_pairs(bounds[::step], sindex)
+    return len(left) * float(len(bounds)) / len(bounds[::step])
+
+
+def _stack_provenance(parts, provenance):
+    """Stacks the (left, right, geoms) parts of one step of `multi_overlay`
+    into the geometries and the provenance of the next step: the rows of
+    `provenance` of the left parents with the right parents appended as a
+    new column, -1 where a part has no parent on that side.
+    """
+    stacked = []
+    for left, right, geoms in parts:
+        n = len(geoms)
+        if left is None:
+            old = numpy.full((n, provenance.shape[1]), -1, dtype=numpy.intp)
+        else:
+            old = provenance[left]
+        new = numpy.full(n, -1, dtype=numpy.intp) if right is None else right
+        stacked.append(numpy.column_stack([old, new]))
+    geoms = _concat_arrays([part[2] for part in parts], object)
+    return geoms, numpy.concatenate(stacked).astype(numpy.intp)
+
+
+def _gather_layers(frames, provenance, geoms, crs):
+    """Gathers the attribute columns of the `frames` of `multi_overlay` for
+    the parents in the columns of `provenance` (-1 for none), see there.
+    """
+    sources = []
+    for k, df in enumerate(frames):
+        index_name = 'idx{}'.format(k + 1)
+        sources.append([(c, i) for i, c in enumerate(df.columns)
+                        if c not in [df.geometry.name, 'geometry', index_name]])
+    seen = {}
+    for columns in sources:
+        for c, _ in columns:
+            seen[c] = seen.get(c, 0) + 1
+
+    data = OrderedDict()
+    for k, (df, columns) in enumerate(zip(frames, sources)):
+        positions = provenance[:, k]
+        missing = positions < 0
+        safe = numpy.where(missing, 0, positions)
+        for c, i in columns:
+            name = '{}_{}'.format(c, k + 1) if seen[c] > 1 else c
+            if missing.all():
+                data[name] = numpy.full(len(positions), numpy.nan)
+            elif missing.any():
+                data[name] = pandas.Series(
+                    df.iloc[:, i].values.take(safe)).where(~missing).values
+            else:
+                data[name] = df.iloc[:, i].values.take(positions)
+        data['idx{}'.format(k + 1)] = \
+            numpy.where(missing, numpy.nan, positions) if missing.any() else positions
+
+    data['geometry'] = geoms
+    return GeoDataFrame(pandas.DataFrame(data), geometry='geometry', crs=crs, copy=False)
+
+
+def _labels(positions, index):
+    """Maps the float array of positions (NaN for none) `positions` to the
+    labels of `index`.
+    """
+    positions = numpy.asarray(positions, dtype=float)
+    missing = numpy.isnan(positions)
+    labels = index.values.take(numpy.where(missing, 0, positions).astype(numpy.intp)) \
+        if len(index) else numpy.full(len(positions), numpy.nan)
+    return pandas.Series(labels).where(~missing).values
+
+
+def _rows_near(df, other):
+    """Returns the positions of the rows of `df` whose bounds meet the bounds
+    of a geometry of the (small) frame `other`, reprojected to the crs of
+    `df` if needed.
+    """
+    if not len(other):
+        return numpy.empty(0, dtype=numpy.intp)
+    geoms = other.geometry
+    if other.crs != df.crs:
+        geoms = geoms.to_crs(df.crs)
+    other_bounds = _bounds(_object_array(geoms.values))
+    sindex = _build_sindex(other_bounds)
+
+    # only the rows within the extent of `other` are queried
+    bounds = geometry_metadata(df).bounds
+    with numpy.errstate(invalid='ignore'):
+        minx, miny = numpy.nanmin(other_bounds[:, :2], axis=0)
+        maxx, maxy = numpy.nanmax(other_bounds[:, 2:], axis=0)
+    rows = numpy.flatnonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) &
+                             (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+    left, _ = _candidate_pairs(bounds[rows], sindex)
+    return rows[numpy.unique(left)]
+
+
+def _grid_size(grid_size, crs):
+    """Returns `grid_size` in the units of `crs`. A `(size, units)` pair is
+    converted from one of `UNITS` with the units reported by `crs_units`.
+    """
+    if not isinstance(grid_size, (tuple, list)):
+        return float(grid_size)
+
+    size, units = grid_size
+    crs_unit = crs_units(crs)
+    if units == crs_unit:
+        return float(size)
+    if units not in UNITS or crs_unit not in UNITS:
+        raise ValueError(
+            'Unable to convert a `grid_size` in {} to the units of the crs, {}. '
+            'Give it in the units of the crs instead.'.format(units, crs_unit))
+    return float(size) * UNITS[units] / UNITS[crs_unit]
+
+
+def _grid_repair(grid_size, crs, repair_input, repair_output):
+    """Returns `grid_size` in the units of `crs` (see `_grid_size`) and the
+    (repair_input, repair_output) flags to overlay with it. With shapely >=
+    2 the geometries snapped by `_snap` are valid, so neither is repaired.
+    """
+    if grid_size is None:
+        return None, repair_input, repair_output
+    grid_size = _grid_size(grid_size, crs)
+    if _set_precision_v is not None:
+        return grid_size, False, False
+    return grid_size, repair_input, repair_output
+
+
+def _snap(geoms, grid_size, stats=None):
+    """Snaps the coordinates of `geoms` to a grid of size `grid_size`. With
+    shapely >= 2 this is `set_precision`, which also makes the geometries
+    valid and removes the collapsed parts; older versions round the
+    coordinates, which may leave invalid geometries behind.
+    """
+    stats = _stats_or_null(stats)
+    with stats.timer('snap'):
+        if _set_precision_v is not None:
+            return _set_precision_v(geoms, grid_size)
+
+        def round_coords(x, y, z=None):
+            return tuple(numpy.round(numpy.asarray(c) / grid_size) * grid_size for c in [x, y])
+
+        return _object_array([transform(round_coords, g) for g in geoms])
+
+
+def _polygonal(geoms):
+    """Returns the array `geoms` with every geometry reduced to its polygonal
+    parts, e.g. the line or point where two polygons only touch becomes an
+    empty polygon.
+    """
+    if _type_id_v is not None:
+        other = ~numpy.isin(_type_id_v(geoms), [3, 6])  # Polygon, MultiPolygon
+    else:
+        other = numpy.array(
+            [g.geom_type not in ['Polygon', 'MultiPolygon'] for g in geoms], dtype=bool)
+
+    if other.any():
+        geoms = _object_array(geoms).copy()
+        for i in numpy.flatnonzero(other):
+            polygons = []
+            for part in getattr(geoms[i], 'geoms', [geoms[i]]):
+                if part.geom_type == 'Polygon':
+                    polygons.append(part)
+                elif part.geom_type == 'MultiPolygon':
+                    polygons.extend(part.geoms)
+            geoms[i] = MultiPolygon(polygons) if len(polygons) > 1 else (
+                polygons[0] if polygons else Polygon())
+    return geoms
+
+
+def _calculate_overlay(df1, df2, how, geoms1=None, geoms2=None, keep_index=False,
+                       engine='cascade', executor=None, repair=True, stats=None,
+                       sindex2=None, prepared2=None, rows2=None, crs=None, bounds1=None,
+                       bounds2=None, explode=False, tile_features=None, curve=None,
+                       grid_size=None):
     """
     Contributors: https://github.com/ozak
         Provided the algorithmic outline for performing the intersection and
         difference functions. His work for geopandas PR: Overlay performance #429
         was adapted and modified to enhance readibility, performance,
         and to improve the test framework.
+
+    The geometry work runs on `geoms1` and `geoms2` (the geometry arrays of
+    `df1` and `df2` by default) and positional indices only; the attribute
+    columns of `df1` and `df2` are gathered once at the end, for the
+    surviving rows only, with `idx1` and `idx2` added when `keep_index`.
+    When `geoms2` only holds the rows `rows2` of `df2`, the parts are mapped
+    back to positions into `df2` before the columns are gathered. `crs` is
+    the crs of the geometries, that of `df1` by default. `bounds1` and
+    `bounds2` are the bounds of `geoms1` and `geoms2` when already known.
+    With `explode`, the output holds the single parts of the geometries.
+    With `tile_features`, the overlay runs tile by tile, see `_tiled_parts`,
+    and with `curve` the rows of `geoms1` are visited along that curve, see
+    `_OverlayPlan`. With `grid_size` the geometry operations snap their
+    results to that grid.
     """
 
-    df1 = df1.copy()
-    df2 = df2.copy()
+    if geoms1 is None:
+        geoms1 = _geometry_array(df1)
+    if geoms2 is None:
+        geoms2 = _geometry_array(df2)
 
-    if how == 'intersection':
-        # Spatial Index to create intersections
-        spatial_index = df2.sindex
-        df1['bbox'] = df1.geometry.apply(lambda x: x.bounds)
-        df1['sidx'] = df1.bbox.apply(
-            lambda x: list(spatial_index.intersection(x)))
-        pairs = df1['sidx'].to_dict()
-        nei = []
-        for i, j in pairs.items():
-            for k in j:
-                nei.append([i, k])
-        if nei != []:
-            pairs = (
-                GeoDataFrame(nei, columns=['pidx1', 'pidx2'], crs=df1.crs)
-                .merge(df1, left_on='pidx1', right_index=True)
-                .merge(df2, left_on='pidx2', right_index=True, suffixes=['_1', '_2'])
-                .assign(
-                    Intersection=lambda _df:
-                        _df.apply(
-                            lambda x: (x['geometry_1'].intersection(x['geometry_2'])).buffer(0), axis=1)
-                )
-                .drop(['pidx1', 'pidx2', 'geometry_1', 'geometry_2', 'sidx', 'bbox'], axis=1)
-                .rename(columns={'Intersection': 'geometry'})
-            )
-            # method chain `merge` operations cause the gdf to drop into a df.
-            # need to re-init gdf.
-            dfinter = GeoDataFrame(pairs, columns=pairs.columns, crs=df1.crs)
-            dfinter = dfinter.loc[dfinter.geometry.is_empty == False]
-            return dfinter.reset_index(drop=True)
+    if tile_features:
+        parts = _tiled_parts(geoms1, geoms2, how, tile_features, engine=engine,
+                             executor=executor, repair=repair, stats=stats,
+                             bounds1=bounds1, bounds2=bounds2, grid_size=grid_size)
+    else:
+        parts = _overlay_parts(geoms1, geoms2, how, engine=engine, executor=executor,
+                               repair=repair, stats=stats, sindex2=sindex2,
+                               prepared2=prepared2, bounds1=bounds1, bounds2=bounds2,
+                               curve=curve, grid_size=grid_size)
+    if rows2 is not None:
+        parts = [(l, r if r is None else rows2[r], g) for l, r, g in parts]
+    return _assemble(df1, df2, parts, crs=df1.crs if crs is None else crs,
+                     keep_index=keep_index, explode=explode, stats=stats)
+
+
+def _overlay_parts(geoms1, geoms2, how, engine='cascade', executor=None, repair=True,
+                   stats=None, sindex2=None, prepared2=None, bounds1=None, bounds2=None,
+                   curve=None, grid_size=None):
+    """Returns the (left, right, geoms) parts of the output of `how`, see
+    `_assemble`, from an `_OverlayPlan` or, with `engine='polygonize'`,
+    from `_polygonize_parts`.
+    """
+    if engine == 'polygonize':
+        return _polygonize_parts(geoms1, geoms2, how, stats=stats, sindex2=sindex2,
+                                 bounds1=bounds1, bounds2=bounds2, grid_size=grid_size)
+    plan = _OverlayPlan(geoms1, geoms2, how=how, engine=engine, executor=executor,
+                        repair=repair, stats=stats, sindex2=sindex2, prepared2=prepared2,
+                        bounds1=bounds1, bounds2=bounds2, curve=curve, grid_size=grid_size)
+    return plan.parts()
+
+
+def _polygonize_parts(geoms1, geoms2, how, stats=None, sindex2=None, bounds1=None,
+                      bounds2=None, grid_size=None):
+    """Computes the parts of `how` like `_OverlayPlan.parts`, but from the
+    planar partition of the two arrays instead of pairwise operations.
+
+    Only the geometries with candidates in the other array take part: their
+    boundaries are noded and polygonized into faces (see
+    `_polygonize_boundaries`), and each face is labelled with the
+    geometries of `geoms1` and of `geoms2` it lies in. The intersection of
+    a pair is the union of the faces labelled with both, the remainder of
+    a geometry the union of its faces labelled with nothing from the other
+    array. Geometries without candidates are their own remainder.
+    """
+    stats = _stats_or_null(stats)
+    if bounds1 is None:
+        bounds1 = _bounds(geoms1)
+    if sindex2 is None:
+        with stats.timer('index'):
+            sindex2 = _build_sindex(_bounds(geoms2) if bounds2 is None else bounds2)
+    with stats.timer('query'):
+        left, right = _candidate_pairs(bounds1, sindex2)
+    stats.count('candidate_pairs', len(left))
+
+    rows1, rows2 = numpy.unique(left), numpy.unique(right)
+    subset = numpy.concatenate([geoms1[rows1], geoms2[rows2]])
+    faces = _polygonize_boundaries(subset, grid_size, stats)
+    with stats.timer('label'):
+        face_rows, parents = _label_faces(faces, subset)
+    first = parents < len(rows1)
+    faces1, parents1 = face_rows[first], rows1[parents[first]]
+    faces2, parents2 = face_rows[~first], rows2[parents[~first] - len(rows1)]
+
+    def dissolve(left, right, face_rows):
+        with stats.timer('merge'):
+            return _merge_fragments([(left, right, faces[face_rows])], grid_size, coverage=True)
+
+    def remainder(side):
+        if side == 1:
+            face_rows, parents, rows, geoms, others = faces1, parents1, rows1, geoms1, faces2
         else:
-            return GeoDataFrame([], columns=list(set(df1.columns).union(df2.columns)), crs=df1.crs)
+            face_rows, parents, rows, geoms, others = faces2, parents2, rows2, geoms2, faces1
+        alone = ~numpy.isin(face_rows, others)
+        keep, _, pieces = dissolve(parents[alone], None, face_rows[alone])
+        untouched = numpy.setdiff1d(numpy.arange(len(geoms)), rows)
+        untouched = untouched[~numpy.array([geoms[i].is_empty for i in untouched], dtype=bool)]
+        keep = numpy.concatenate([keep, untouched]).astype(numpy.intp)
+        order = numpy.argsort(keep, kind='mergesort')
+        pieces = _concat_arrays([pieces, geoms[untouched]], object)
+        return keep[order], pieces[order]
+
+    def intersection():
+        pairs = pandas.merge(pandas.DataFrame({'face': faces1, 'left': parents1}),
+                             pandas.DataFrame({'face': faces2, 'right': parents2}), on='face')
+        left, right, pieces = dissolve(pairs['left'].values.astype(numpy.intp),
+                                       pairs['right'].values.astype(numpy.intp),
+                                       pairs['face'].values)
+        stats.count('intersections', len(left))
+        return left, right, pieces
 
+    def difference(side):
+        keep, pieces = remainder(side)
+        return (keep, None, pieces) if side == 1 else (None, keep, pieces)
+
+    if how == 'intersection':
+        return [intersection()]
     elif how in ['difference', 'erase']:
-        spatial_index = df2.sindex
-
-        df1['bbox'] = df1.geometry.apply(lambda x: x.bounds)
-        df1['sidx'] = df1.bbox.apply(
-            lambda x: list(spatial_index.intersection(x)))
-        df1['new_g'] = df1.apply(
-            lambda x: reduce(
-                lambda x, y:
-                    x.difference(y).buffer(0),
-                    [x.geometry] + list(df2.iloc[x.sidx].geometry)
-            ), axis=1
+        return [difference(1)]
+    elif how == 'symmetric_difference':
+        return [difference(1), difference(2)]
+    elif how == 'union':
+        return [intersection(), difference(1), difference(2)]
+    elif how == 'identity':
+        return [difference(1), intersection()]
+    raise NotImplementedError(how)
+
+
+class _OverlayPlan(object):
+    """Holds the work shared by every `how` of a single overlay of the
+    geometry arrays `geoms1` and `geoms2`: the candidate pairs from one bulk
+    index query, the pairwise intersections and the remainder of each
+    geometry once the parts covered by the other frame are removed. Results
+    are computed on first use.
+
+    For 'union' and 'identity', which compute the intersections anyway, the
+    remainders only subtract the candidates whose intersection turned out
+    to be non-empty, and the remainder of `df2` reuses the same pairs from
+    the other side, so that e.g. a union costs one index query, one
+    intersection pass and two subtractions. The other `how`s subtract the
+    candidate pairs directly and never intersect.
+
+    With an `executor` the geometry work is split into chunks of at most
+    `BATCH_SIZE` candidate pairs, each shipped to a worker together with
+    only the geometries it references. Chunks are mapped in order, so the
+    result is the same as the serial one.
+
+    With `repair`, invalid intersections and differences are passed through
+    `buffer(0)`; the repairs are counted in `stats`, merged back from the
+    workers in parallel runs.
+
+    `sindex2` and `prepared2` are the spatial index and the prepared
+    geometries of `geoms2` when they already exist, see `OverlayLayer`, and
+    `bounds1` and `bounds2` their bounds, see `GeometryMetadata`.
+
+    With a `curve`, `geoms1` is reordered along that space filling curve
+    (see `spatial_keys`) before the index query, so that consecutive
+    candidate pairs, and therefore batches and chunks, stay in one region.
+    `order` holds the original position of each reordered row; `parts`
+    maps the positions back and restores the original order.
+
+    With `grid_size` the intersections and differences are snapped to a
+    grid of that size, see `spatial_overlay`.
+    """
+
+    def __init__(self, geoms1, geoms2, how='intersection', engine='cascade', executor=None,
+                 repair=True, stats=None, sindex2=None, prepared2=None, bounds1=None,
+                 bounds2=None, curve=None, grid_size=None):
+        self.order = None
+        if curve is not None:
+            if bounds1 is None:
+                bounds1 = _bounds(geoms1)
+            self.order = numpy.argsort(_curve_keys(bounds1, curve), kind='mergesort')
+            geoms1, bounds1 = geoms1[self.order], bounds1[self.order]
+
+        self.geoms1 = geoms1
+        self.geoms2 = geoms2
+        self.how = how
+        self.engine = engine
+        self.executor = executor
+        self.repair = repair
+        self.grid_size = grid_size
+        self.stats = _stats_or_null(stats)
+        self.prepared2 = prepared2
+        if sindex2 is None:
+            with self.stats.timer('index'):
+                sindex2 = _build_sindex(_bounds(geoms2) if bounds2 is None else bounds2)
+        with self.stats.timer('query'):
+            if bounds1 is None:
+                bounds1 = _bounds(geoms1)
+            self.left, self.right = _candidate_pairs(bounds1, sindex2)
+        self.stats.count('candidate_pairs', len(self.left))
+        self._intersections = None
+        self._remainders = {}
+
+    @property
+    def intersections(self):
+        """(left, right, geoms) for every pair with a non-empty intersection."""
+        if self._intersections is None:
+            with self.stats.timer('intersection'):
+                self._intersections = self._intersect()
+            self.stats.count('intersections', len(self._intersections[0]))
+        return self._intersections
+
+    def _intersect(self):
+        if self.executor is None:
+            return _intersection_kernel(
+                self.geoms1, self.geoms2, self.left, self.right,
+                repair=self.repair, stats=self.stats, prepared=self.prepared2,
+                grid_size=self.grid_size)
+
+        chunks = _chunk_pairs(self.geoms1, self.geoms2, self.left, self.right)
+        results = self.executor.map(
+            _intersection_task,
+            [task + (self.repair, self.grid_size) for _, _, task in chunks])
+        lefts, rights, geoms = [], [], []
+        for (rows, others, _), ((l, r, g), stats) in zip(chunks, results):
+            self.stats.merge(stats)
+            lefts.append(rows[l])
+            rights.append(others[r])
+            geoms.append(g)
+        return (
+            _concat_arrays(lefts, numpy.intp),
+            _concat_arrays(rights, numpy.intp),
+            _concat_arrays(geoms, object),
         )
-        df1.geometry = df1.new_g
-        df1 = df1.loc[df1.geometry.is_empty == False].copy()
-        df1.drop(['bbox', 'sidx', 'new_g'], axis=1, inplace=True)
-        df1.reset_index(inplace=True, drop=True)
-        return df1
 
-    elif how == 'symmetric_difference':
-        s1 = _calculate_overlay(
-            df1, df2, how='difference')
-        s2 = _calculate_overlay(
-            df2, df1, how='difference')
-        s3 = pandas.concat([s1, s2]).reset_index(drop=True)
-        return s3
+    def remainder(self, side):
+        """(keep, geoms) for the geometries of `df1` (side=1) or `df2`
+        (side=2) with everything covered by the other frame removed.
+        """
+        if side not in self._remainders:
+            if self.how in ['union', 'identity']:
+                left, right, _ = self.intersections
+            else:
+                left, right = self.left, self.right
 
-    elif how == 'union':
-        s1 = _calculate_overlay(
-            df1, df2, how='intersection')
-        s2 = _calculate_overlay(
-            df1, df2, how='difference')
-        s3 = _calculate_overlay(
-            df2, df1, how='difference')
-        s4 = pandas.concat([s1, s2, s3]).reset_index(drop=True)
-        return s4
+            if side == 1:
+                geoms, others, prepared = self.geoms1, self.geoms2, self.prepared2
+            else:
+                geoms, others, prepared = self.geoms2, self.geoms1, None
+                order = numpy.argsort(right, kind='mergesort')
+                left, right = right[order], left[order]
 
-    elif how == 'identity':
-        s1 = _calculate_overlay(
-            df1, df2, how='difference')
-        s2 = _calculate_overlay(
-            df1, df2, how='intersection')
-        s3 = pandas.concat([s1, s2]).reset_index(drop=True)
-        return s3
-
-    # elif how == 'clip':
-    #     s1 = _calculate_overlay(
-    #         df1, df2, how='difference', reproject=reproject)
-    #     s2 = _calculate_overlay(
-    #         df1, s2, how='difference', reproject=reproject)
-    #     return s2
-
-    # elif how == 'cover':
-    #     s1 = _calculate_overlay(
-    #         df2, df1, how='difference', reproject=reproject)
-    #     s2 = pandas.concat([df1, s1]).reset_index(drop=True)
-    #     return s2
+            with self.stats.timer('difference'):
+                if self.executor is None:
+                    self._remainders[side] = _difference_kernel(
+                        geoms, others, left, right, engine=self.engine,
+                        repair=self.repair, stats=self.stats, prepared=prepared,
+                        grid_size=self.grid_size)
+                else:
+                    results = _object_array(geoms).copy()
+                    chunks = _chunk_pairs(geoms, others, left, right, whole_rows=True)
+                    tasks = [task + (self.engine, self.repair, self.grid_size)
+                             for _, _, task in chunks]
+                    for (rows, _, _), (g, stats) in zip(
+                            chunks, self.executor.map(_difference_task, tasks)):
+                        self.stats.merge(stats)
+                        results[rows] = g
+                    keep = numpy.array([not g.is_empty for g in results], dtype=bool)
+                    self.stats.count('empty_discarded', len(keep) - keep.sum())
+                    self._remainders[side] = numpy.flatnonzero(keep), results[keep]
+        return self._remainders[side]
+
+    def intersection(self):
+        return self.intersections
+
+    def difference(self, side):
+        keep, geoms = self.remainder(side)
+        return (keep, None, geoms) if side == 1 else (None, keep, geoms)
+
+    def parts(self, remainder2=True):
+        """The (left, right, geoms) parts of the output of `how`, in output
+        order; see `_assemble`. With `remainder2=False` the remainder of
+        `geoms2` is left out of 'union' and 'symmetric_difference'.
+        """
+        how = self.how
+        if how == 'intersection':
+            parts = [self.intersection()]
+
+        elif how in ['difference', 'erase']:
+            parts = [self.difference(1)]
+
+        elif how == 'symmetric_difference':
+            parts = [self.difference(1)]
+            if remainder2:
+                parts.append(self.difference(2))
+
+        elif how == 'union':
+            parts = [self.intersection(), self.difference(1)]
+            if remainder2:
+                parts.append(self.difference(2))
+
+        elif how == 'identity':
+            parts = [self.difference(1), self.intersection()]
+
+        else:
+            raise NotImplementedError(how)
+
+        if self.order is not None:
+            parts = [self._restore(*part) for part in parts]
+        return parts
+
+    def _restore(self, left, right, geoms):
+        """Maps the positions into the reordered `geoms1` of a part back to
+        the original positions and puts the part back in their order.
+        """
+        if left is None:
+            return left, right, geoms
+        left = self.order[left]
+        order = numpy.argsort(left, kind='mergesort')
+        return left[order], None if right is None else right[order], geoms[order]
+
+
+def _tiled_parts(geoms1, geoms2, how, tile_features, engine='cascade', executor=None,
+                 repair=True, stats=None, bounds1=None, bounds2=None, grid_size=None):
+    """Overlays `geoms1` and `geoms2` tile by tile and returns the same
+    (left, right, geoms) parts as `_OverlayPlan.parts`.
+
+    The tiles come from `_quadtree_tiles` over the bounds of both arrays.
+    Each geometry is clipped to every tile its bounds touch and each tile
+    is overlaid on its own, with `executor.map` when given. The pieces of an
+    output geometry that were cut apart by tile edges share the same
+    parents and are merged back with `_merge_fragments`.
+    """
+    stats = _stats_or_null(stats)
+    if bounds1 is None:
+        bounds1 = _bounds(geoms1)
+    if bounds2 is None:
+        bounds2 = _bounds(geoms2)
+
+    with stats.timer('tiling'):
+        tiles = _quadtree_tiles(numpy.vstack([bounds1, bounds2]), tile_features)
+        if not len(tiles):
+            return _overlay_parts(geoms1, geoms2, how, engine=engine, repair=repair,
+                                  stats=stats, grid_size=grid_size)
+        sindex = _build_sindex(tiles)
+        rows1 = _tile_rows(bounds1, sindex, len(tiles))
+        rows2 = _tile_rows(bounds2, sindex, len(tiles))
+        tasks = []
+        for tile, r1, r2 in zip(tiles, rows1, rows2):
+            g1, r1 = _clip(geoms1[r1], r1, tile)
+            g2, r2 = _clip(geoms2[r2], r2, tile)
+            tasks.append((r1, r2, (g1, g2, how, engine, repair, grid_size)))
+    stats.count('tiles', len(tiles))
+
+    results = (executor or _Serial()).map(_tile_task, [task for _, _, task in tasks])
+    pieces = None
+    for (r1, r2, _), (parts, tile_stats) in zip(tasks, results):
+        stats.merge(tile_stats)
+        parts = [(l if l is None else r1[l], r if r is None else r2[r], g)
+                 for l, r, g in parts]
+        pieces = [[part] for part in parts] if pieces is None else [
+            kind + [part] for kind, part in zip(pieces, parts)]
+
+    with stats.timer('merge'):
+        return [_merge_fragments(kind, grid_size) for kind in pieces]
+
+
+class _Serial(object):
+    """Runs the tasks of a tiled overlay in process, like an executor."""
+
+    def map(self, func, tasks):
+        return (func(task) for task in tasks)
+
+
+def _quadtree_tiles(bounds, max_features, max_depth=MAX_TILE_DEPTH):
+    """Splits the extent of `bounds` into a quadtree of tiles. A tile is
+    split in four while more than `max_features` of the rows of `bounds`
+    have their center in it, so tiles are small where features are dense.
+
+    Parameters
+    ----------
+    bounds : (n, 4) array of (minx, miny, maxx, maxy)
+    max_features : int
+    max_depth : int, optional
+        number of splits after which a tile is kept whatever its count.
+
+    Returns
+    -------
+    (m, 4) float array
+        the bounds of the tiles, which cover the extent without overlap.
+
+    """
+    bounds = bounds[numpy.isfinite(bounds).all(axis=1)]
+    if not len(bounds):
+        return numpy.empty((0, 4))
+
+    cx = (bounds[:, 0] + bounds[:, 2]) / 2
+    cy = (bounds[:, 1] + bounds[:, 3]) / 2
+    extent = (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+
+    tiles = []
+    stack = [(extent, numpy.arange(len(bounds)), 0)]
+    while stack:
+        (x0, y0, x1, y1), rows, depth = stack.pop()
+        if len(rows) <= max_features or depth >= max_depth:
+            tiles.append((x0, y0, x1, y1))
+            continue
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        east, north = cx[rows] >= xm, cy[rows] >= ym
+        for quadrant, mask in [((x0, y0, xm, ym), ~east & ~north),
+                               ((xm, y0, x1, ym), east & ~north),
+                               ((x0, ym, xm, y1), ~east & north),
+                               ((xm, ym, x1, y1), east & north)]:
+            stack.append((quadrant, rows[mask], depth + 1))
+    return numpy.array(tiles, dtype=float)
+
+
+def _tile_rows(bounds, sindex, n):
+    """Returns, for each of the `n` tiles in `sindex`, the positions of the
+    rows of `bounds` that touch it.
+    """
+    rows, tiles = _candidate_pairs(bounds, sindex)
+    order = numpy.argsort(tiles, kind='mergesort')
+    return _group_pairs(tiles[order], rows[order], n)
+
+
+def _clip(geoms, rows, tile):
+    """Clips `geoms` to the rectangle `tile` and returns the polygonal
+    pieces that are not empty, with their positions from `rows`.
+    """
+    if _clip_by_rect_v is not None:
+        clipped = _clip_by_rect_v(geoms, *tile)
+    else:
+        rect = box(*tile)
+        clipped = _object_array([g.intersection(rect) for g in geoms])
+    clipped = _polygonal(_object_array(clipped))
+    keep = numpy.array([not g.is_empty for g in clipped], dtype=bool)
+    return clipped[keep], rows[keep]
+
+
+def _tile_task(args):
+    geoms1, geoms2, how, engine, repair, grid_size = args
+    stats = OverlayStats()
+    parts = _overlay_parts(geoms1, geoms2, how, engine=engine, repair=repair, stats=stats,
+                           grid_size=grid_size)
+    return parts, stats
+
+
+def _merge_fragments(parts, grid_size=None, coverage=False):
+    """Stacks the (left, right, geoms) parts of one kind from every tile and
+    unions the fragments that share their parents, ordered by their parents,
+    on the grid `grid_size` when given. With `coverage` the fragments are
+    known to share their edges exactly (e.g. faces from a polygonization)
+    and are dissolved with the much cheaper coverage union.
+    """
+    left, right, geoms = parts[0][0], parts[0][1], [part[2] for part in parts]
+    if left is not None:
+        left = _concat_arrays([part[0] for part in parts], numpy.intp)
+    if right is not None:
+        right = _concat_arrays([part[1] for part in parts], numpy.intp)
+    geoms = _concat_arrays(geoms, object)
+
+    keys = numpy.column_stack([
+        numpy.zeros(len(geoms), dtype=numpy.intp) if k is None else k
+        for k in [left, right]])
+    if not len(keys):
+        return left, right, geoms
+
+    keys, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = numpy.argsort(inverse, kind='mergesort')
+    groups = numpy.split(order, numpy.cumsum(numpy.bincount(inverse))[:-1])
+
+    if coverage and _coverage_union_all_v is not None:
+        union = _coverage_union_all_v
+    else:
+        def union(fragments):
+            return _union(fragments, grid_size)
+    merged = _object_array([geoms[g[0]] if len(g) == 1 else union(geoms[g]) for g in groups])
+    return (None if left is None else keys[:, 0],
+            None if right is None else keys[:, 1],
+            merged)
+
+
+def _polygonize_boundaries(geoms, grid_size=None, stats=None):
+    """Nodes the boundaries of the polygons `geoms` in one union and
+    polygonizes the linework into the faces of their planar partition.
+    """
+    stats = _stats_or_null(stats)
+    with stats.timer('node'):
+        if _boundary_v is not None:
+            lines = _boundary_v(geoms[~_is_empty_v(geoms)])
+        else:
+            lines = [g.boundary for g in geoms if not g.is_empty]
+        noded = _union(lines, grid_size)
+
+    with stats.timer('polygonize'):
+        if _polygonize_v is not None:
+            faces = _get_parts_v(_polygonize_v(_get_parts_v(noded)))
+        else:
+            faces = _object_array(list(polygonize(getattr(noded, 'geoms', [noded]))))
+    stats.count('faces', len(faces))
+    return faces
+
+
+def _label_faces(faces, geoms, sindex=None):
+    """Finds the polygons of `geoms` each face of `faces` lies in, testing a
+    point inside the face against the candidates from `sindex` (the index
+    of `geoms`, built if not given).
+
+    Returns
+    -------
+    face_rows, parents : 1-D integer arrays
+        positions into `faces` and `geoms` of every (face, parent) pair,
+        sorted by face.
+
+    """
+    if sindex is None:
+        sindex = _build_sindex(_bounds(geoms))
+    if _point_on_surface_v is not None:
+        points = _point_on_surface_v(faces)
+    else:
+        points = _object_array([f.representative_point() for f in faces])
+
+    face_rows, parents = _candidate_pairs(_bounds(points), sindex)
+    if _prepare_v is not None:
+        with _prepared(geoms[numpy.unique(parents)]):
+            inside = _contains_v(geoms[parents], points[face_rows])
+    else:
+        prepared = {}
+        inside = numpy.zeros(len(parents), dtype=bool)
+        for k, (i, j) in enumerate(zip(face_rows, parents)):
+            if j not in prepared:
+                prepared[j] = prep(geoms[j])
+            inside[k] = prepared[j].contains(points[i])
+    return face_rows[inside], parents[inside]
+
+
+def _geometry_array(df):
+    """Returns the active geometry column of `df` as a 1-D object array."""
+    return geometry_metadata(df).geoms
+
+
+def _intersection_kernel(geoms1, geoms2, left, right, batch_size=BATCH_SIZE, repair=True,
+                         stats=None, prepared=None, grid_size=None):
+    """Intersects `geoms1[left]` with `geoms2[right]` pair by pair, working
+    through the candidate arrays `batch_size` pairs at a time. Only the
+    polygonal part of each intersection is kept.
+
+    Pairs where one geometry lies within the other, or where the two are
+    disjoint, are recognized with prepared geometries (see `_relate_pairs`)
+    and produce the inner geometry or nothing without an overlay.
+
+    Parameters
+    ----------
+    geoms1, geoms2 : 1-D object arrays of shapely geometries
+    left, right : 1-D integer arrays of candidate pairs, see `_candidate_pairs`
+    batch_size : int, optional
+        number of pairs handed to shapely per call.
+    repair : boolean, optional (default=True)
+        pass the invalid intersections through `buffer(0)`.
+    stats : OverlayStats, optional
+        counts the repairs as 'repaired_output', the pairs resolved by
+        predicates (see `_relate_pairs`) and the empty intersections as
+        'empty_discarded'.
+    prepared : dict, optional
+        prepared geometries of `geoms2` by position, see `_relate_pairs`.
+    grid_size : float, optional
+        snap the intersections to a grid of this size (shapely >= 2).
+
+    Returns
+    -------
+    left, right : 1-D integer arrays
+        the candidate pairs whose intersection is not empty.
+    geoms : 1-D object array
+        the intersection of each of the surviving pairs.
+
+    """
+    keep, results = [], []
+    with _prepared(geoms2[numpy.unique(right)]):
+        for start in range(0, len(left), batch_size):
+            l, r = left[start:start + batch_size], right[start:start + batch_size]
+            within, contains, disjoint = _relate_pairs(
+                geoms1, geoms2, l, r, stats, prepared, touching=grid_size is not None)
+            overlap = ~(within | contains | disjoint)
+
+            inter = numpy.empty(len(l), dtype=object)
+            inter[within] = geoms1[l[within]]
+            inter[contains] = geoms2[r[contains]]
+
+            g1, g2 = geoms1[l[overlap]], geoms2[r[overlap]]
+            if _intersection_v is not None:
+                pieces = _intersection_v(g1, g2, **_grid(grid_size))
+            else:
+                pieces = _object_array([a.intersection(b) for a, b in zip(g1, g2)])
+            pieces = _polygonal(pieces)
+            if repair:
+                pieces = _repair(pieces, stats, 'repaired_output')
+            inter[overlap] = pieces
+
+            empty = disjoint.copy()
+            if _is_empty_v is not None:
+                empty[overlap] = _is_empty_v(pieces)
+            else:
+                empty[overlap] = [g.is_empty for g in pieces]
+            _stats_or_null(stats).count('empty_discarded', empty.sum())
+            keep.append(~empty)
+            results.append(inter[~empty])
+
+    if not keep:
+        return left, right, _object_array([])
+
+    keep = numpy.concatenate(keep)
+    return left[keep], right[keep], numpy.concatenate(results)
+
+
+def _measure_kernel(geoms1, geoms2, left, right, measure='area', batch_size=BATCH_SIZE,
+                    repair=True, stats=None, prepared=None, grid_size=None):
+    """Measures the intersections of `geoms1[left]` and `geoms2[right]` like
+    `_intersection_kernel` builds them, keeping only the area (or, for the
+    lines of `geoms1` with `measure='length'`, the length) of each.
+
+    Returns
+    -------
+    left, right : 1-D integer arrays
+        the candidate pairs with a non-zero measure.
+    values : 1-D float array
+
+    """
+    size = _area if measure == 'area' else _length
+    values = numpy.zeros(len(left))
+    with _prepared(geoms2[numpy.unique(right)]):
+        for start in range(0, len(left), batch_size):
+            l, r = left[start:start + batch_size], right[start:start + batch_size]
+            within, contains, disjoint = _relate_pairs(
+                geoms1, geoms2, l, r, stats, prepared, touching=grid_size is not None)
+            overlap = ~(within | contains | disjoint)
+
+            batch = values[start:start + batch_size]
+            batch[within] = size(geoms1[l[within]])
+            batch[contains] = size(geoms2[r[contains]])
+
+            g1, g2 = geoms1[l[overlap]], geoms2[r[overlap]]
+            if _intersection_v is not None:
+                pieces = _intersection_v(g1, g2, **_grid(grid_size))
+            else:
+                pieces = _object_array([a.intersection(b) for a, b in zip(g1, g2)])
+            if measure == 'area':
+                pieces = _polygonal(pieces)
+                if repair:
+                    pieces = _repair(pieces, stats, 'repaired_output')
+            batch[overlap] = size(pieces)
+
+    keep = values > 0
+    _stats_or_null(stats).count('empty_discarded', len(keep) - keep.sum())
+    return left[keep], right[keep], values[keep]
+
+
+def _difference_kernel(geoms1, geoms2, left, right, engine='cascade', repair=True, stats=None,
+                       prepared=None, grid_size=None):
+    """Subtracts from each geometry in `geoms1` all of its candidates in
+    `geoms2`. Geometries without candidates, or disjoint from all of them,
+    are returned untouched and geometries within one of their candidates
+    become empty, both without an overlay (see `_relate_pairs`).
+
+    Parameters
+    ----------
+    geoms1, geoms2 : 1-D object arrays of shapely geometries
+    left, right : 1-D integer arrays of candidate pairs, see `_candidate_pairs`
+    engine : string, optional (default='cascade')
+        'cascade' unions the candidates of each row once and performs a
+        single difference; 'reduce' subtracts the candidates one at a time.
+    repair : boolean, optional (default=True)
+        pass the invalid differences through `buffer(0)`.
+    stats : OverlayStats, optional
+        counts the repairs as 'repaired_output' and the empty differences
+        as 'empty_discarded'.
+    prepared : dict, optional
+        prepared geometries of `geoms2` by position, see `_relate_pairs`.
+    grid_size : float, optional
+        snap the differences to a grid of this size (shapely >= 2).
+
+    Returns
+    -------
+    keep : 1-D integer array
+        positions into `geoms1` whose difference is not empty.
+    geoms : 1-D object array
+        the difference for each position in `keep`.
+
+    """
+    results = _subtract_candidates(
+        geoms1, geoms2, left, right, engine=engine, repair=repair, stats=stats,
+        prepared=prepared, grid_size=grid_size)
+    keep = numpy.array([not g.is_empty for g in results], dtype=bool)
+    _stats_or_null(stats).count('empty_discarded', len(keep) - keep.sum())
+    return numpy.flatnonzero(keep), results[keep]
+
+
+def _subtract_candidates(geoms1, geoms2, left, right, engine='cascade', repair=True,
+                         stats=None, prepared=None, grid_size=None):
+    """Returns a copy of `geoms1` with the candidates of each row removed,
+    including the rows whose difference is empty. See `_difference_kernel`.
+    """
+    results = _object_array(geoms1).copy()
+
+    within, _, disjoint = _relate_pairs(
+        geoms1, geoms2, left, right, stats, prepared, touching=grid_size is not None)
+    covered = numpy.unique(left[within])
+    for i in covered:
+        results[i] = Polygon()
+    live = ~disjoint & ~numpy.isin(left, covered)
+    left, right = left[live], right[live]
 
+    candidates = _group_pairs(left, right, len(geoms1))
+    rows = numpy.flatnonzero(numpy.bincount(left, minlength=len(geoms1)))
+
+    for i in rows:
+        others = geoms2[candidates[i]]
+        if engine == 'cascade':
+            if len(others) > 1:
+                # only the part of each candidate within the row's bounds
+                # can be subtracted, so keep the union small.
+                box = results[i].envelope
+                others = [_union([o.intersection(box) for o in others], grid_size)]
+            results[i] = _difference(results[i], others[0], grid_size)
+        else:
+            results[i] = reduce(lambda x, y: _difference(x, y, grid_size), others, results[i])
+
+    if repair and len(rows):
+        results[rows] = _repair(results[rows], stats, 'repaired_output')
+    return results
+
+
+def _difference(geom, other, grid_size=None):
+    """Returns `geom` minus `other`, snapped to the grid `grid_size` when
+    given. Snapping can collapse parts of the difference into lines, which
+    are dropped, as the next difference on the grid rejects them.
+    """
+    if not _grid(grid_size):
+        return geom.difference(other)
+    other = _polygonal(_object_array([other]))[0]
+    return _polygonal(_object_array([geom.difference(other, grid_size=grid_size)]))[0]
+
+
+def _relate_pairs(geoms1, geoms2, left, right, stats=None, prepared=None, touching=False):
+    """Classifies the candidate pairs `geoms1[left]`, `geoms2[right]` with
+    prepared versions of the geometries of `geoms2`, which are reused for
+    all of the pairs they take part in. Where shapely cannot prepare
+    geometries in place (shapely < 2) the prepared geometries are kept in
+    the dict `prepared` by position into `geoms2`, which may already hold
+    some of them. Otherwise they are prepared in place for the call only,
+    see `_prepared`.
+
+    With `touching`, pairs that only share boundary are classified as
+    disjoint too, since their intersection has no area. This pays off on
+    snapped geometries, where neighbours share their edges exactly.
+
+    Returns
+    -------
+    within, contains, disjoint : 1-D boolean arrays
+        whether `geoms1[left]` lies within `geoms2[right]`, contains it or
+        does not touch it (or, with `touching`, shares no interior with
+        it). At most one of them is True for each pair.
+
+    """
+    n = len(left)
+    within = numpy.zeros(n, dtype=bool)
+    contains = numpy.zeros(n, dtype=bool)
+
+    if _prepare_v is not None:
+        g1, g2 = geoms1[left], geoms2[right]
+        with _prepared(geoms2[numpy.unique(right)]):
+            disjoint = _disjoint_v(g2, g1)
+            rest = numpy.flatnonzero(~disjoint)
+            within[rest] = _contains_v(g2[rest], g1[rest])
+            rest = rest[~within[rest]]
+            contains[rest] = _within_v(g2[rest], g1[rest])
+            if touching:
+                rest = rest[~contains[rest]]
+                touches = numpy.zeros(n, dtype=bool)
+                touches[rest] = _touches_v(g2[rest], g1[rest])
+                disjoint |= touches
     else:
-        raise NotImplementedError(how)
+        disjoint = numpy.zeros(n, dtype=bool)
+        touches = numpy.zeros(n, dtype=bool)
+        prepared = {} if prepared is None else prepared
+        for k, (i, j) in enumerate(zip(left, right)):
+            if prepared.get(j) is None:
+                prepared[j] = prep(geoms2[j])
+            if prepared[j].disjoint(geoms1[i]):
+                disjoint[k] = True
+            elif prepared[j].contains(geoms1[i]):
+                within[k] = True
+            elif prepared[j].within(geoms1[i]):
+                contains[k] = True
+            elif touching and prepared[j].touches(geoms1[i]):
+                disjoint[k] = touches[k] = True
+
+    stats = _stats_or_null(stats)
+    stats.count('pairs_within', within.sum())
+    stats.count('pairs_contains', contains.sum())
+    stats.count('pairs_disjoint', disjoint.sum())
+    if touching:
+        stats.count('pairs_touching', touches.sum())
+    return within, contains, disjoint
+
+
+@contextmanager
+def _prepared(geoms):
+    """Prepares the geometries in the array `geoms` in place for the
+    duration of the block (shapely >= 2, a no-op otherwise). Geometries that
+    are already prepared, e.g. those of an `OverlayLayer`, are left as they
+    are; the others are released again on exit, so that the geometries of
+    the frames passed in are not left prepared.
+    """
+    if _prepare_v is None:
+        yield
+        return
+    fresh = geoms[~_is_prepared_v(geoms)]
+    _prepare_v(fresh)
+    try:
+        yield
+    finally:
+        _destroy_prepared_v(fresh)
+
+
+def _chunk_pairs(geoms1, geoms2, left, right, whole_rows=False, batch_size=BATCH_SIZE):
+    """Splits the candidate pairs into chunks of about `batch_size` pairs
+    for the workers of a parallel overlay.
+
+    Returns
+    -------
+    list of (rows, others, task) tuples, where `rows` and `others` are the
+    positions into `geoms1` and `geoms2` referenced by the chunk and `task`
+    is the (geoms1[rows], geoms2[others], left, right) payload with `left`
+    and `right` renumbered into those subsets. With `whole_rows`, chunks
+    only break between rows so that all candidates of a row stay together.
+
+    """
+    bounds = list(range(0, len(left), batch_size)) + [len(left)]
+    if whole_rows:
+        starts = numpy.flatnonzero(numpy.diff(left)) + 1
+        bounds = sorted(set(
+            [0, len(left)] +
+            [int(starts[numpy.searchsorted(starts, b)]) for b in bounds[1:-1]
+             if numpy.searchsorted(starts, b) < len(starts)]
+        ))
+
+    chunks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows, l = numpy.unique(left[start:stop], return_inverse=True)
+        others, r = numpy.unique(right[start:stop], return_inverse=True)
+        task = (geoms1[rows], geoms2[others], l.astype(numpy.intp), r.astype(numpy.intp))
+        chunks.append((rows, others, task))
+    return chunks
+
+
+def _intersection_task(args):
+    geoms1, geoms2, left, right, repair, grid_size = args
+    stats = OverlayStats()
+    result = _intersection_kernel(geoms1, geoms2, left, right, repair=repair, stats=stats,
+                                  grid_size=grid_size)
+    return result, stats
+
+
+def _difference_task(args):
+    geoms1, geoms2, left, right, engine, repair, grid_size = args
+    stats = OverlayStats()
+    result = _subtract_candidates(
+        geoms1, geoms2, left, right, engine=engine, repair=repair, stats=stats,
+        grid_size=grid_size)
+    return result, stats
+
+
+def _union(geoms, grid_size=None):
+    """Unions `geoms`, snapped to the grid `grid_size` when given."""
+    if _union_all_v is not None:
+        return _union_all_v(geoms, **_grid(grid_size))
+    return unary_union(list(geoms))
+
+
+def _grid(grid_size):
+    """Keyword arguments that make a shapely operation snap its result to
+    the grid `grid_size`, which only shapely >= 2 supports.
+    """
+    if grid_size is None or _set_precision_v is None:
+        return {}
+    return {'grid_size': grid_size}
+
+
+def _concat_arrays(arrays, dtype):
+    if not arrays:
+        return numpy.empty(0, dtype=dtype)
+    return numpy.concatenate(arrays).astype(dtype)
+
+
+def _assemble(df1, df2, parts, crs=None, keep_index=False, explode=False, stats=None):
+    """Builds the output GeoDataFrame of an overlay, gathering the attribute
+    columns of `df1` and `df2` exactly once.
+
+    Parameters
+    ----------
+    df1, df2 : GeoDataFrame
+        the frames the attributes are taken from.
+    parts : list of (left, right, geoms) tuples
+        `left` and `right` are the positions into `df1` and `df2` of the
+        parents of each geometry in `geoms`, or None when the part has no
+        parent in that frame (the remainders). The parts are stacked in
+        order.
+    crs : dict, optional
+        crs of the output.
+    keep_index : boolean, optional (default=False)
+        add the parent positions as the columns `idx1` and `idx2`.
+    explode : boolean, optional (default=False)
+        split the geometries of each part into single parts first, repeating
+        their parent positions, so that the attributes are gathered for the
+        single parts directly.
+    stats : OverlayStats, optional
+        times the stages 'explode' and 'assemble' and counts the
+        'output_rows'.
+
+    Returns
+    -------
+    GeoDataFrame
+        In parts with parents in both frames, column names shared by both
+        frames get the suffixes '_1' and '_2'. Columns a part does not carry
+        are NaN.
+
+    """
+    stats = _stats_or_null(stats)
+    if explode:
+        with stats.timer('explode'):
+            parts = [_explode_part(*part) for part in parts]
+
+    with stats.timer('assemble'):
+        df = _gather(df1, df2, parts, crs, keep_index)
+    stats.count('output_rows', len(df))
+    return df
+
+
+def _gather(df1, df2, parts, crs, keep_index):
+    """Gathers the attribute columns of the `parts` from `df1` and `df2`,
+    see `_assemble`.
+    """
+    index_names = ['idx1', 'idx2'] if keep_index else [None, None]
+    sources = []
+    for df, index_name in zip([df1, df2], index_names):
+        columns = [(c, i) for i, c in enumerate(df.columns)
+                   if c not in [df.geometry.name, 'geometry', index_name]]
+        if index_name is not None:
+            columns.append((index_name, None))
+        sources.append(columns)
+    shared = set(c for c, _ in sources[0]).intersection(c for c, _ in sources[1])
+
+    # output column -> {part number: (frame, column position, positions)}
+    gather = OrderedDict()
+    for k, part in enumerate(parts):
+        paired = part[0] is not None and part[1] is not None
+        for side, (df, positions) in enumerate(zip([df1, df2], part[:2])):
+            if positions is None:
+                continue
+            for c, i in sources[side]:
+                name = '{}_{}'.format(c, side + 1) if paired and c in shared else c
+                gather.setdefault(name, {})[k] = (df, i, positions)
+
+    lengths = [len(part[2]) for part in parts]
+    data = OrderedDict()
+    for name, sources_by_part in gather.items():
+        pieces = []
+        for k, n in enumerate(lengths):
+            if k not in sources_by_part:
+                pieces.append(pandas.Series(numpy.full(n, numpy.nan)))
+                continue
+            df, i, positions = sources_by_part[k]
+            if i is None:
+                values = positions
+            else:
+                values = df.iloc[:, i].values.take(positions)
+            pieces.append(pandas.Series(values))
+        if len(pieces) == 1:
+            data[name] = pieces[0].values
+        else:
+            data[name] = pandas.concat(pieces, ignore_index=True).values
+
+    data['geometry'] = _concat_arrays([part[2] for part in parts], object)
+    return GeoDataFrame(pandas.DataFrame(data), geometry='geometry', crs=crs, copy=False)
+
+
+def _explode_part(left, right, geoms):
+    """Splits the geometries of an output part into single parts."""
+    geoms, parents = explode_geometries(geoms)
+    left = None if left is None else left[parents]
+    right = None if right is None else right[parents]
+    return left, right, geoms
+
+
+def _build_sindex(bounds, path=None):
+    """Bulk loads a spatial index from an (n, 4) array of bounds. Index ids
+    are the positions of the rows in `bounds`; rows with non-finite bounds
+    (empty geometries) are not indexed. In memory this is a shapely STRtree
+    of the bounding boxes where available (shapely >= 2), which
+    `_candidate_pairs` queries in bulk, and an rtree index otherwise. With
+    `path` an rtree index is written to the files `path`.dat and
+    `path`.idx.
+    """
+    if path is None and _strtree_v is not None:
+        return _strtree_v(_boxes(bounds))
+
+    args = [] if path is None else [path]
+    rows = numpy.flatnonzero(numpy.isfinite(bounds).all(axis=1))
+    if len(rows):
+        args.append((int(i), tuple(bounds[i]), None) for i in rows)
+    return rtree.index.Index(*args)
+
+
+def _boxes(bounds):
+    """Returns the rectangles of an (n, 4) array of bounds as an object
+    array, with None for the rows with non-finite bounds."""
+    boxes = numpy.full(len(bounds), None, dtype=object)
+    rows = numpy.isfinite(bounds).all(axis=1)
+    if rows.any():
+        boxes[rows] = _box_v(*bounds[rows].T)
+    return boxes
+
+
+def _saved_sindex(geoms, index_dir, bounds=None):
+    """Returns the bounds of `geoms` and their spatial index, using the
+    files saved in `index_dir` under the content hash of `geoms` and saving
+    them first if needed. `bounds` are the bounds of `geoms` when already
+    known. Files are written under a temporary name and then moved into
+    place, so a crashed or concurrent build never leaves a partial file
+    behind.
+
+    With shapely >= 2 the bounds are saved as `.npy` and the index is an
+    STRtree bulk loaded from them (see `_build_sindex`), since the bulk
+    query of a file-backed rtree index fails under numpy < 2 and
+    `_candidate_pairs` would fall back to one query per row. Otherwise the
+    rtree index itself is saved as a `.dat`/`.idx` file pair; the returned
+    index keeps the files open until it is garbage collected.
+    """
+    path = os.path.join(index_dir, 'sindex_{}'.format(_geometry_hash(geoms)))
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+    if _strtree_v is not None:
+        if os.path.exists(path + '.npy'):
+            bounds = numpy.load(path + '.npy')
+        else:
+            if bounds is None:
+                bounds = _bounds(geoms)
+            numpy.save(tmp + '.npy', bounds)
+            _move_into_place(tmp, path, ['.npy'])
+        return bounds, _build_sindex(bounds)
+
+    if bounds is None:
+        bounds = _bounds(geoms)
+    extensions = ['.dat', '.idx']
+    if not all(os.path.exists(path + ext) for ext in extensions):
+        _build_sindex(bounds, tmp).close()
+        _move_into_place(tmp, path, extensions)
+    return bounds, rtree.index.Index(path)
+
+
+def _move_into_place(tmp, path, extensions):
+    """Renames the files `tmp` + extension to `path` + extension."""
+    for ext in extensions:
+        try:
+            os.rename(tmp + ext, path + ext)
+        except OSError:  # another process saved it first
+            os.remove(tmp + ext)
+
+
+def _geometry_hash(geoms):
+    """Returns the sha1 hex digest of the WKB of the geometries in `geoms`."""
+    digest = hashlib.sha1(str(len(geoms)).encode('ascii'))
+    if _to_wkb_v is not None:
+        wkbs = _to_wkb_v(geoms)
+    else:
+        wkbs = (g.wkb for g in geoms)
+    for wkb in wkbs:
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def _candidate_pairs(bounds, sindex):
+    """Queries `sindex` with every row of `bounds` in a single pass.
+
+    Parameters
+    ----------
+    bounds : (n, 4) array of (minx, miny, maxx, maxy)
+    sindex : shapely STRtree or rtree.index.Index with positional ids,
+        see `_build_sindex`
+
+    Returns
+    -------
+    left_idx, right_idx : 1-D integer arrays
+        positions into `bounds` and into the indexed geometries for every
+        pair of intersecting bounding boxes, sorted by `left_idx`.
+
+    """
+    rows = numpy.flatnonzero(numpy.isfinite(bounds).all(axis=1))
+    if not len(rows):
+        return numpy.empty(0, dtype=numpy.intp), numpy.empty(0, dtype=numpy.intp)
+
+    if _strtree_v is not None and isinstance(sindex, _strtree_v):
+        left, right = sindex.query(_boxes(bounds[rows]))
+        order = numpy.argsort(left, kind='mergesort')
+        return rows[left[order]].astype(numpy.intp), right[order].astype(numpy.intp)
+
+    right = None
+    if hasattr(sindex, 'intersection_v'):  # rtree >= 1.0
+        try:
+            right, counts = sindex.intersection_v(
+                bounds[rows, :2], bounds[rows, 2:])
+        except TypeError:
+            # rtree 1.x cannot grow its result buffer under numpy < 2
+            right = None
+
+    if right is None:
+        hits = [numpy.fromiter(sindex.intersection(tuple(bounds[i])), dtype=numpy.intp)
+                for i in rows]
+        counts = [len(h) for h in hits]
+        right = numpy.concatenate(hits)
+
+    left = numpy.repeat(rows, numpy.asarray(counts, dtype=numpy.intp))
+    return left.astype(numpy.intp), numpy.asarray(right, dtype=numpy.intp)
+
+
+def _group_pairs(left, right, n):
+    """Splits `right` into one array of candidates per position in
+    `range(n)`. Expects `left` to be sorted, as returned by `_candidate_pairs`.
+    """
+    counts = numpy.bincount(left, minlength=n)
+    return numpy.split(right, numpy.cumsum(counts)[:-1])
@@ -1,8 +1,11 @@
+import sys
+
 import pytest
 
 import geopandas
 
-from geopandas_ext.epsg_utils import  epsg_to_dict, crs_units
+from geopandas_ext import epsg_utils
+from geopandas_ext.epsg_utils import  epsg_to_dict, crs_units, batch_crs_units
 
 
 proj_ft = geopandas.read_file(geopandas.datasets.get_path('nybb')).crs
@@ -27,3 +30,49 @@ def test_epsg_to_dict():
 def test_crs_units(crs, expected):
 
     assert crs_units(crs) == expected
+
+
+def test_epsg_lookup_is_offline(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyepsg', None)
+    assert crs_units(2263) == 'us-ft'
+    assert epsg_to_dict(4326) == wgs84_dct
+
+
+def test_epsg_cache():
+    epsg_utils._cache.clear()
+    epsg_to_dict(4326)
+    assert 4326 in epsg_utils._cache
+
+    cache = epsg_utils._LRUCache(maxsize=2)
+    for key in [1, 2, 1, 3]:
+        cache.put(key, key)
+    assert 1 in cache and 3 in cache and 2 not in cache
+
+
+def test_epsg_fallback():
+    with pytest.raises(ValueError):
+        epsg_to_dict(999999)
+
+    with pytest.raises(ValueError):
+        epsg_to_dict(999999, fallback=['carrier-pigeon'])
+
+
+def test_package_exports():
+    import geopandas_ext
+
+    for name in epsg_utils.__all__:
+        assert getattr(geopandas_ext, name) is getattr(epsg_utils, name)
+    for name in ['EPSG_FALLBACK', 'EPSG_TABLE', 'csv', 'gzip']:
+        assert not hasattr(geopandas_ext, name)
+
+
+def test_crs_units_crs_objects():
+    import pyproj
+    assert crs_units(pyproj.CRS.from_epsg(2263)) == 'us-ft'
+    assert crs_units(pyproj.CRS.from_epsg(4326)) == 'degrees'
+    assert crs_units(pyproj.CRS.from_proj4('+proj=utm +zone=18 +ellps=GRS80 +units=m')) == 'm'
+
+
+def test_batch_crs_units():
+    crss = [wgs84, swiss, {'init': 'epsg:2263'}, swiss, wgs84]
+    assert batch_crs_units(crss) == ['degrees', 'm', 'us-ft', 'm', 'degrees']
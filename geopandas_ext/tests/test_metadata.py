@@ -0,0 +1,81 @@
+import gc
+
+import numpy
+
+from geopandas import GeoDataFrame
+
+from shapely.geometry import LineString, Point, Polygon
+
+from geopandas_ext.metadata import (
+    GEOMETRY_TYPE_IDS, GeometryMetadata, geometry_metadata, _store)
+
+
+class TestGeometryMetadata:
+
+    def setup_method(self):
+        self.bowtie = Polygon([(0, 0), (2, 2), (2, 0), (0, 2)])
+        self.df = GeoDataFrame({'geometry': [
+            Polygon([(0, 0), (1, 0), (1, 1), (0, 1)]),
+            self.bowtie,
+            LineString([(0, 0), (3, 4)]),
+        ]})
+
+    def test_values(self):
+        meta = geometry_metadata(self.df)
+
+        assert numpy.allclose(meta.bounds[0], [0, 0, 1, 1])
+        assert list(meta.type_ids) == [GEOMETRY_TYPE_IDS['Polygon'],
+                                       GEOMETRY_TYPE_IDS['Polygon'],
+                                       GEOMETRY_TYPE_IDS['LineString']]
+        assert list(meta.is_polygonal()) == [True, True, False]
+        assert list(meta.is_lineal()) == [False, False, True]
+        assert list(meta.valid) == [True, False, True]
+        assert list(meta.vertex_counts) == [5, 5, 2]
+        assert numpy.allclose(meta.area, [1, 0, 0])
+
+    def test_cached_per_frame(self):
+        meta = geometry_metadata(self.df)
+        bounds = meta.bounds
+
+        assert geometry_metadata(self.df) is meta
+        assert geometry_metadata(self.df).bounds is bounds
+        assert geometry_metadata(self.df.copy()) is not meta
+
+    def test_invalidated_when_geometry_changes(self):
+        meta = geometry_metadata(self.df)
+        self.df.geometry = self.df.buffer(1)
+
+        changed = geometry_metadata(self.df)
+        assert changed is not meta
+        assert numpy.allclose(changed.bounds[0], [-1, -1, 2, 2])
+
+    def test_invalidated_when_modified_in_place(self):
+        meta = geometry_metadata(self.df)
+        self.df.loc[0, 'geometry'] = Point(5, 5).buffer(1)
+
+        changed = geometry_metadata(self.df)
+        assert changed is not meta
+        assert numpy.allclose(changed.bounds[0], [4, 4, 6, 6])
+        assert numpy.allclose(meta.bounds[0], [0, 0, 1, 1])
+
+    def test_released_with_frame(self):
+        df = GeoDataFrame({'geometry': [Point(0, 0).buffer(1)]})
+        key = id(df)
+        geometry_metadata(df)
+        assert key in _store
+
+        del df
+        gc.collect()
+        assert key not in _store
+
+    def test_lazy(self):
+        meta = GeometryMetadata(geometry_metadata(self.df).geoms)
+        meta.bounds
+        assert list(meta._values) == ['bounds']
+
+    def test_module_importable(self):
+        import geopandas_ext
+        import geopandas_ext.metadata as module
+
+        assert module._store is _store
+        assert geopandas_ext.geometry_metadata is module.geometry_metadata
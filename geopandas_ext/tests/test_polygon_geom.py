@@ -1,11 +1,15 @@
 import pytest
 
+import numpy
+
 import geopandas
 from geopandas import GeoDataFrame, read_file
 
-from shapely.geometry import Point
+from shapely import wkt
+from shapely.geometry import MultiPolygon, Point, Polygon
 
-from geopandas_ext.polygon_geom import  explode_multipart_polygons, gdf_bbox
+from geopandas_ext.polygon_geom import  explode_multipart_polygons, explode_geometries, gdf_bbox
+from geopandas_ext.polygon_geom import sort_spatially, spatial_keys
 
 
 def test_gdf_bbox():
@@ -15,6 +19,37 @@ def test_gdf_bbox():
     assert polydf.crs == bboxdf.crs
     assert tst.all()
 
+
+def test_gdf_bbox_densify():
+    polydf = geopandas.read_file(geopandas.datasets.get_path('nybb'))
+    bboxdf = gdf_bbox(polydf, densify=3)
+    assert len(bboxdf.geometry[0].exterior.coords) == 4 * 4 + 1
+    assert bboxdf.geometry[0].equals(gdf_bbox(polydf).geometry[0])
+
+
+@pytest.mark.parametrize('curve', ['hilbert', 'morton'])
+def test_spatial_keys(curve):
+    cells = [(x, y) for x in range(4) for y in range(4)]
+    gdf = GeoDataFrame({'geometry': [Point(x, y).buffer(0.1) for x, y in cells] + [Polygon()]})
+    keys = spatial_keys(gdf, curve=curve, level=2)
+
+    # every cell of the 4 x 4 grid gets its own key, the empty row the last
+    assert sorted(keys[:-1]) == list(range(16))
+    assert keys[-1] == keys.max()
+    if curve == 'hilbert':
+        path = numpy.array(cells)[numpy.argsort(keys[:-1])]
+        assert (numpy.abs(numpy.diff(path, axis=0)).sum(axis=1) == 1).all()
+
+
+def test_sort_spatially():
+    polydf = geopandas.read_file(geopandas.datasets.get_path('nybb'))
+    ordered = sort_spatially(polydf)
+    assert sorted(ordered.index) == list(polydf.index)
+    assert ordered.sort_index().equals(polydf)
+    with pytest.raises(ValueError):
+        spatial_keys(polydf, curve='peano')
+
+
 class TestExplodeMultipartPolygons:
 
 
@@ -50,3 +85,26 @@ class TestExplodeMultipartPolygons:
         polydf2_ex = explode_multipart_polygons(self.polydf2)
         assert self.polydf2.crs == polydf2_ex.crs
         assert polydf2_ex.shape == (11, 3)
+
+    def test_explode_multipart_polygons_attributes(self):
+        polydf_ex = explode_multipart_polygons(self.polydf)
+        assert list(polydf_ex.columns) == list(self.polydf.columns)
+        assert (polydf_ex.geom_type == 'Polygon').all()
+
+        areas = polydf_ex.area.groupby(polydf_ex['BoroCode']).sum()
+        expected = self.polydf.set_index('BoroCode').area
+        assert ((areas - expected.loc[areas.index]).abs() < 1e-3).all()
+
+    def test_explode_geometries(self):
+        a, b, c = [Point(x, 0).buffer(0.4) for x in range(3)]
+        parts, parents = explode_geometries([MultiPolygon([a, b]), c])
+        assert list(parents) == [0, 0, 1]
+        assert parts[0].equals(a) and parts[2].equals(c)
+
+    def test_explode_geometries_drops_empty(self):
+        # a multipolygon with an empty part, as left behind by some drivers
+        multi = wkt.loads('MULTIPOLYGON (EMPTY, ((0 0, 1 0, 1 1, 0 0)))')
+        b = Point(3, 0).buffer(0.4)
+        parts, parents = explode_geometries([Polygon(), multi, b])
+        assert list(parents) == [1, 2]
+        assert parts[0].equals(multi.geoms[1]) and parts[1].equals(b)
@@ -1,12 +1,25 @@
+import sys
+
 import numpy
+import pandas
 from pandas.util.testing import assert_series_equal
 
-from shapely.geometry import Point, Polygon
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon
 
+import fiona
 import geopandas
 from geopandas import GeoDataFrame, read_file
 
 from geopandas_ext.spatial_overlay import spatial_overlay as overlay
+from geopandas_ext.spatial_overlay import (
+    spatial_overlay_files, flatten_overlaps, multi_overlay, tabulate_intersection, apportion,
+    update_overlay, OverlayLayer)
+from geopandas_ext.overlay_stats import OverlayStats
+from geopandas_ext.spatial_overlay import (
+    _OverlayPlan, _assemble, _bounds, _build_sindex, _candidate_pairs, _grid_size,
+    _chunk_pairs, _difference_kernel, _geometry_array, _intersection_kernel,
+    _join_order, _merge_fragments, _overlapping_rows, _polygonal, _quadtree_tiles,
+    _relate_pairs, _repair)
 
 import pytest
 
@@ -436,3 +449,759 @@ class TestDataFrame_crs:
         # Geopandas Issue #305
         with pytest.raises(NotImplementedError):
             overlay(self.polydf, self.polydf2.geometry, how="union", **self.kwargs)
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'union', 'identity',
+                                     'symmetric_difference', 'difference'])
+    def test_parallel_matches_serial(self, how):
+        serial = overlay(self.polydf, self.polydf2, how=how, **self.kwargs)
+        parallel = overlay(self.polydf, self.polydf2, how=how, n_jobs=2, **self.kwargs)
+
+        assert serial.shape == parallel.shape
+        assert serial.geom_equals(parallel).all()
+        assert serial.drop('geometry', axis=1).equals(parallel.drop('geometry', axis=1))
+
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'difference', 'union', 'identity',
+                                     'symmetric_difference'])
+    def test_layer_matches_frame(self, how):
+        layer = OverlayLayer(self.polydf2)
+        expected = overlay(self.polydf, self.polydf2, how=how, **self.kwargs)
+
+        for _ in range(2):
+            result = overlay(self.polydf, layer, how=how, **self.kwargs)
+            assert expected.shape == result.shape
+            assert expected.geom_equals(result).all()
+
+        # the layer is reprojected once and reused
+        assert len(layer._projections) == 1
+
+    @pytest.mark.parametrize('how', ['intersection', 'union'])
+    def test_inputs_left_unprepared(self, how):
+        shapely = pytest.importorskip('shapely', minversion='2.0')
+        df1, df2 = self.polydf.copy(), self.polydf2.to_crs(self.polydf.crs)
+        overlay(df1, df2, how=how, **self.kwargs)
+
+        assert not shapely.is_prepared(df1.geometry.values.data).any()
+        assert not shapely.is_prepared(df2.geometry.values.data).any()
+
+        overlay(df1, OverlayLayer(df2), how=how, **self.kwargs)
+        assert not shapely.is_prepared(df1.geometry.values.data).any()
+
+
+    def test_saved_sindex(self, tmpdir, monkeypatch):
+        index_dir = str(tmpdir)
+        expected = overlay(self.polydf, self.polydf, how='intersection')
+        result = overlay(self.polydf, self.polydf, how='intersection', index_dir=index_dir)
+        assert expected.geom_equals(result).all()
+        saved = len(tmpdir.listdir())
+        assert saved > 0
+
+        # later layers with the same geometries load the saved files ...
+        module = sys.modules['geopandas_ext.spatial_overlay']
+        def fail(*args):
+            raise AssertionError('index saved again')
+        with monkeypatch.context() as m:
+            m.setattr(module, '_move_into_place', fail)
+            layer = OverlayLayer(self.polydf, index_dir=index_dir)
+        result = overlay(self.polydf, layer, how='intersection')
+        assert expected.geom_equals(result).all()
+        assert numpy.array_equal(layer.bounds, _bounds(layer.geoms))
+        if module._strtree_v is not None:
+            # queried in bulk, like an index built in memory
+            assert isinstance(layer.sindex, module._strtree_v)
+
+        # ... and a changed layer gets files of its own
+        changed = self.polydf.copy()
+        changed.geometry = changed.buffer(10)
+        OverlayLayer(changed, index_dir=index_dir)
+        assert len(tmpdir.listdir()) == 2 * saved
+
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'difference', 'identity'])
+    def test_reproject_overlapping_rows_only(self, how):
+        borough = self.polydf.iloc[[2]]
+        rows = _overlapping_rows(borough, _bounds(_geometry_array(self.polydf2)), self.polydf2.crs)
+        assert 0 < len(rows) < len(self.polydf2)
+
+        expected = overlay(borough, self.polydf2.to_crs(borough.crs), how=how)
+        result = overlay(borough, self.polydf2, how=how)
+        assert expected.shape == result.shape
+        assert expected.geom_equals(result).all()
+        assert expected.drop('geometry', axis=1).equals(result.drop('geometry', axis=1))
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'union', 'identity'])
+    def test_reproject_auto(self, how):
+        # the circles have far fewer vertices than the boroughs, so they are
+        # reprojected and the result is transformed back to their crs.
+        expected = overlay(self.polydf2, self.polydf, how=how)
+        result = overlay(self.polydf2, self.polydf, how=how, reproject='auto')
+
+        assert result.crs == self.polydf2.crs
+        assert expected.shape == result.shape
+        assert expected['idx2'].equals(result['idx2'])
+        assert numpy.allclose(expected.area, result.area, rtol=1e-6)
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'difference', 'union', 'identity',
+                                     'symmetric_difference'])
+    def test_curve_keeps_order(self, how):
+        expected = overlay(self.polydf, self.polydf2, how=how)
+        result = overlay(self.polydf, self.polydf2, how=how, curve='hilbert')
+
+        assert expected.shape == result.shape
+        assert expected.drop('geometry', axis=1).equals(result.drop('geometry', axis=1))
+        assert numpy.allclose(expected.area, result.area, rtol=1e-9)
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'difference', 'union', 'identity',
+                                     'symmetric_difference'])
+    def test_tiled_matches_untiled(self, how):
+        stats = OverlayStats()
+        expected = overlay(self.polydf, self.polydf2, how=how)
+        result = overlay(self.polydf, self.polydf2, how=how, tile_features=2, stats=stats)
+
+        # the pieces cut apart by tile edges are merged back by their parents
+        assert stats.counts['tiles'] > 1
+        columns = [c for c in ['idx1', 'idx2'] if c in expected]
+        expected = expected.sort_values(columns).reset_index(drop=True)
+        result = result.sort_values(columns).reset_index(drop=True)
+        assert expected.shape == result.shape
+        assert expected[columns].equals(result[columns])
+        assert numpy.allclose(expected.area, result.area, rtol=1e-6)
+        assert result.geometry.is_valid.all()
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('how', ['intersection', 'difference', 'union', 'identity',
+                                     'symmetric_difference'])
+    @pytest.mark.parametrize('tile_features', [None, 2])
+    def test_polygonize_engine(self, how, tile_features):
+        # a duplicate circle, so that faces have more than one parent per side
+        df2 = self.polydf2.iloc[list(range(len(self.polydf2))) + [4]].reset_index(drop=True)
+        expected = overlay(self.polydf, df2, how=how)
+        result = overlay(self.polydf, df2, how=how, engine='polygonize',
+                         tile_features=tile_features)
+
+        columns = [c for c in ['idx1', 'idx2'] if c in expected]
+        expected = expected.sort_values(columns).reset_index(drop=True)
+        result = result.sort_values(columns).reset_index(drop=True)
+        assert expected.shape == result.shape
+        assert expected.drop('geometry', axis=1).equals(result.drop('geometry', axis=1))
+        assert numpy.allclose(expected.area, result.area, rtol=1e-6)
+        assert result.geometry.is_valid.all()
+
+
+class TestOverlayFiles:
+    """`spatial_overlay_files` should write the same features that
+    `spatial_overlay` returns for the same layers.
+    """
+
+    def setup_method(self):
+        N = 10
+
+        self.polydf = read_file(geopandas.datasets.get_path('nybb'))
+
+        b = [int(x) for x in self.polydf.total_bounds]
+        self.polydf2 = GeoDataFrame(
+            [{'geometry': Point(x, y).buffer(10000), 'value1': x + y,
+              'value2': x - y}
+             for x, y in zip(range(b[0], b[2], int((b[2]-b[0])/N)),
+                             range(b[1], b[3], int((b[3]-b[1])/N)))],
+            crs=self.polydf.crs,
+            )
+
+    @pytest.mark.parametrize('how', ['intersection', 'union', 'identity',
+                                     'symmetric_difference', 'difference'])
+    def test_overlay_files(self, tmpdir, how):
+        path1 = str(tmpdir.join('polydf.shp'))
+        path2 = str(tmpdir.join('polydf2.shp'))
+        out_path = str(tmpdir.join('out.shp'))
+        self.polydf.to_file(path1)
+        self.polydf2.to_file(path2)
+
+        spatial_overlay_files(path1, path2, out_path, how=how, batch_size=2)
+        df = read_file(out_path)
+        expected = overlay(self.polydf, self.polydf2, how=how)
+
+        assert df.shape == expected.shape
+        assert abs(df.geometry.area.sum() - expected.geometry.area.sum()) < 1
+        assert sorted(df['idx1'].fillna(-1)) == sorted(expected['idx1'].fillna(-1))
+
+    @pytest.mark.parametrize('how', ['union', 'symmetric_difference'])
+    def test_overlay_files_empty_first_layer(self, tmpdir, how):
+        path1 = str(tmpdir.join('empty.shp'))
+        path2 = str(tmpdir.join('polydf2.shp'))
+        out_path = str(tmpdir.join('out.shp'))
+        schema = {'geometry': 'Polygon', 'properties': {'col1': 'int'}}
+        with fiona.open(path1, 'w', driver='ESRI Shapefile', schema=schema,
+                        crs=self.polydf2.crs.to_wkt()):
+            pass
+        self.polydf2.to_file(path2)
+
+        spatial_overlay_files(path1, path2, out_path, how=how)
+        df = read_file(out_path)
+
+        assert len(df) == len(self.polydf2)
+        assert sorted(df['idx2']) == list(range(len(self.polydf2)))
+
+    def test_overlay_files_index_once(self, tmpdir, monkeypatch):
+        path1 = str(tmpdir.join('polydf.shp'))
+        path2 = str(tmpdir.join('polydf2.shp'))
+        self.polydf.to_file(path1)
+        self.polydf2.to_file(path2)
+
+        module = sys.modules['geopandas_ext.spatial_overlay']
+        built = []
+        build = module._build_sindex
+        monkeypatch.setattr(module, '_build_sindex',
+                            lambda *args: built.append(len(args[0])) or build(*args))
+        spatial_overlay_files(path1, path2, str(tmpdir.join('out.shp')), batch_size=2)
+        assert built == [len(self.polydf2)]
+
+    def test_overlay_files_engine(self, tmpdir):
+        path = str(tmpdir.join('polydf.shp'))
+        self.polydf.to_file(path)
+        with pytest.raises(ValueError):
+            spatial_overlay_files(path, path, str(tmpdir.join('out.shp')), engine='polygonize')
+
+
+class TestOverlayKernels:
+    """Checks the array-based building blocks of `_calculate_overlay`."""
+
+    def setup_method(self):
+        self.df1 = GeoDataFrame(
+            {'geometry': [Point(0, 0).buffer(1), Point(10, 10).buffer(1)]})
+        self.df2 = GeoDataFrame(
+            {'geometry': [Point(1, 1).buffer(1), Point(1.2, -1.2).buffer(0.3),
+                          Point(50, 50).buffer(1)]})
+        self.geoms1 = _geometry_array(self.df1)
+        self.geoms2 = _geometry_array(self.df2)
+
+    def test_candidate_pairs(self):
+        left, right = _candidate_pairs(
+            _bounds(self.geoms1), _build_sindex(_bounds(self.geoms2)))
+        assert sorted(zip(left, right)) == [(0, 0), (0, 1)]
+
+    def test_intersection_kernel(self):
+        left, right = _candidate_pairs(
+            _bounds(self.geoms1), _build_sindex(_bounds(self.geoms2)))
+        left, right, geoms = _intersection_kernel(self.geoms1, self.geoms2, left, right)
+
+        # the bbox of the second candidate overlaps, but the circles do not.
+        assert list(zip(left, right)) == [(0, 0)]
+        assert geoms[0].equals(self.df1.geometry[0].intersection(self.df2.geometry[0]))
+
+    @pytest.mark.parametrize('engine', ['cascade', 'reduce'])
+    def test_difference_kernel(self, engine):
+        left, right = _candidate_pairs(
+            _bounds(self.geoms1), _build_sindex(_bounds(self.geoms2)))
+        keep, geoms = _difference_kernel(
+            self.geoms1, self.geoms2, left, right, engine=engine)
+
+        expected = self.df1.geometry[0].difference(self.df2.geometry[0])
+        assert list(keep) == [0, 1]
+        assert abs(geoms[0].area - expected.area) < 1e-9
+        # rows without candidates skip the geometry work entirely
+        assert geoms[1] is self.geoms1[1]
+
+    def test_relate_pairs(self):
+        big = Point(0, 0).buffer(5)
+        geoms = _geometry_array(GeoDataFrame({'geometry': [big]}))
+        within, contains, disjoint = _relate_pairs(
+            numpy.concatenate([self.geoms1, self.geoms2[:1]]), geoms,
+            numpy.array([0, 1, 2]), numpy.array([0, 0, 0]))
+        assert list(within) == [True, False, True]
+        assert list(disjoint) == [False, True, False]
+        assert not contains.any()
+
+        within, contains, disjoint = _relate_pairs(
+            geoms, self.geoms1, numpy.array([0, 0]), numpy.array([0, 1]))
+        assert list(contains) == [True, False] and list(disjoint) == [False, True]
+
+    def test_prepared_shortcuts(self):
+        big = _geometry_array(GeoDataFrame({'geometry': [Point(0, 0).buffer(5)]}))
+        left, right = numpy.array([0, 1]), numpy.array([0, 0])
+
+        # a geometry within its candidate is its own intersection ...
+        l, r, geoms = _intersection_kernel(self.geoms1, big, left, right)
+        assert list(zip(l, r)) == [(0, 0)] and geoms[0] is self.geoms1[0]
+
+        # ... and has no difference left, while a disjoint one is untouched
+        keep, geoms = _difference_kernel(self.geoms1, big, left, right)
+        assert list(keep) == [1] and geoms[0] is self.geoms1[1]
+
+    def test_overlay_plan(self):
+        plan = _OverlayPlan(self.geoms1, self.geoms2, how="union")
+        left, right, _ = plan.intersections
+
+        # both remainders are derived from the one set of intersections
+        keep1, geoms1 = plan.remainder(1)
+        keep2, geoms2 = plan.remainder(2)
+        assert list(zip(left, right)) == [(0, 0)]
+        assert list(keep1) == [0, 1] and list(keep2) == [0, 1, 2]
+        assert plan.remainder(1)[1] is geoms1
+
+        expected = self.df2.geometry[0].difference(self.df1.geometry[0])
+        assert abs(geoms2[0].area - expected.area) < 1e-9
+
+    def test_quadtree_tiles(self):
+        bounds = numpy.array([[0, 0, 1, 1], [0.1, 0.1, 0.2, 0.2], [0.2, 0.2, 0.3, 0.3],
+                              [9, 9, 10, 10]], dtype=float)
+        tiles = _quadtree_tiles(bounds, 2)
+
+        # only the crowded corner is split further, and the tiles cover the extent
+        assert [5, 5, 10, 10] in tiles.tolist()
+        assert (tiles[:, 2] - tiles[:, 0]).min() < 0.5
+        assert abs(numpy.prod(tiles[:, 2:] - tiles[:, :2], axis=1).sum() - 100) < 1e-9
+        assert len(_quadtree_tiles(bounds, 4)) == 1
+
+    def test_merge_fragments(self):
+        halves = [Polygon([(0, 0), (1, 0), (1, 1), (0, 1)]),
+                  Polygon([(1, 0), (2, 0), (2, 1), (1, 1)])]
+        geoms = _geometry_array(GeoDataFrame({'geometry': halves + [self.geoms1[0]]}))
+        parts = [(numpy.array([3, 0]), None, geoms[[0, 2]]),
+                 (numpy.array([3]), None, geoms[[1]])]
+        left, right, merged = _merge_fragments(parts)
+
+        assert right is None and list(left) == [0, 3]
+        assert merged[0] is geoms[2]
+        assert merged[1].geom_type == 'Polygon' and merged[1].area == 2
+
+    def test_chunk_pairs(self):
+        geoms1, geoms2 = self.geoms1, self.geoms2
+        left = numpy.array([0, 0, 0, 1, 1])
+        right = numpy.array([0, 1, 2, 1, 2])
+
+        chunks = _chunk_pairs(geoms1, geoms2, left, right, batch_size=2)
+        assert [len(task[2]) for _, _, task in chunks] == [2, 2, 1]
+
+        # whole rows are never split across chunks
+        chunks = _chunk_pairs(geoms1, geoms2, left, right, whole_rows=True, batch_size=2)
+        assert [list(rows) for rows, _, _ in chunks] == [[0], [1]]
+        rows, others, (g1, g2, l, r) = chunks[1]
+        assert list(others[r]) == [1, 2] and g1[0] is geoms1[1]
+
+    def test_assemble_explode(self):
+        df1 = self.df1.assign(value=[1, 2])
+        multi = MultiPolygon([self.geoms1[0], self.geoms1[1]])
+        parts = [(numpy.array([1]), None, _geometry_array(GeoDataFrame({'geometry': [multi]})))]
+        df = _assemble(df1, self.df2, parts, keep_index=True, explode=True)
+
+        assert len(df) == 2 and (df.geom_type == 'Polygon').all()
+        assert list(df['value']) == [2, 2] and list(df['idx1']) == [1, 1]
+
+    def test_assemble(self):
+        df1 = self.df1.assign(name=['a', 'b'], value=[1, 2])
+        df2 = self.df2.assign(value=[10, 20, 30])
+        parts = [
+            (numpy.array([0]), numpy.array([2]), self.geoms1[:1]),
+            (numpy.array([1]), None, self.geoms1[1:]),
+        ]
+        df = _assemble(df1, df2, parts, keep_index=True)
+
+        assert list(df.columns) == ['name', 'value_1', 'idx1', 'value_2', 'idx2',
+                                    'value', 'geometry']
+        assert list(df['value_2'].fillna(-1)) == [30, -1]
+        assert list(df['value'].fillna(-1)) == [-1, 2]
+        assert list(df['idx1']) == [0, 1]
+        assert 'idx1' not in df1.columns
+
+
+class TestRepair:
+    """Checks the `repair` policy of `spatial_overlay`."""
+
+    def setup_method(self):
+        bowtie = Polygon([(0, 0), (2, 2), (2, 0), (0, 2)])
+        self.df1 = GeoDataFrame(
+            {'value1': [1, 2], 'geometry': [bowtie, Point(5, 5).buffer(1)]})
+        self.df2 = GeoDataFrame(
+            {'value2': [1], 'geometry': [Polygon([(1, 0), (6, 0), (6, 6), (1, 6)])]})
+
+    def test_repair_invalid_rows_only(self):
+        geoms = _geometry_array(self.df1)
+        stats = OverlayStats()
+        repaired = _repair(geoms, stats, 'repaired_input')
+
+        assert repaired[0].is_valid and repaired[1] is geoms[1]
+        assert stats.counts['repaired_input'] == 1
+        assert 'repair' in stats.timings
+
+    @pytest.mark.parametrize('repair', ['all', 'input'])
+    def test_repair_input(self, repair):
+        stats = OverlayStats()
+        df = overlay(self.df1, self.df2, how='intersection', repair=repair, stats=stats)
+
+        assert stats.counts['repaired_input'] == 1
+        assert df.geometry.is_valid.all()
+        assert abs(df.loc[df['value1'] == 2].area.sum() - numpy.pi) < 0.01
+
+    def test_repair_output_only(self):
+        stats = OverlayStats()
+        overlay(self.df1.iloc[1:], self.df2, how='union', repair='output', stats=stats)
+        assert 'repaired_input' not in stats.counts
+        assert stats.counts['repaired_output'] == 0
+
+    def test_bad_repair(self):
+        with pytest.raises(ValueError):
+            overlay(self.df1, self.df2, repair='everything')
+
+    def test_polygonal(self):
+        square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+        touching = Polygon([(1, 0), (2, 0), (2, 1), (1, 1)])
+        geoms = _polygonal(_geometry_array(GeoDataFrame(
+            {'geometry': [square, square.intersection(touching)]})))
+
+        assert geoms[0] is square
+        assert geoms[1].is_empty and geoms[1].geom_type == 'Polygon'
+
+
+class TestStats:
+    """Checks the stage timings and counters collected by `OverlayStats`."""
+
+    def setup_method(self):
+        self.df1 = GeoDataFrame(
+            {'value1': [1, 2, 3],
+             'geometry': [Point(x, 0).buffer(1) for x in [0, 1, 10]]})
+        self.df2 = GeoDataFrame(
+            {'value2': [1, 2],
+             'geometry': [Point(0.5, 0).buffer(1), Point(11.6, 1.6).buffer(1)]})
+
+    def test_stages_and_counts(self):
+        stats = OverlayStats()
+        df = overlay(self.df1, self.df2, how='union', explode=True, stats=stats)
+
+        for stage in ['total', 'index', 'query', 'intersection', 'difference',
+                      'explode', 'assemble']:
+            assert stats.timings[stage] >= 0
+        assert stats.counts['candidate_pairs'] == 3
+        assert stats.counts['intersections'] == 2
+        assert stats.counts['empty_discarded'] == 1
+        assert stats.counts['output_rows'] == len(df)
+
+    def test_symmetric_difference_skips_intersections(self):
+        stats = OverlayStats()
+        overlay(self.df1, self.df2, how='symmetric_difference', stats=stats)
+
+        assert 'intersection' not in stats.timings
+        assert 'difference' in stats.timings
+
+    def test_callback(self):
+        events = []
+        stats = OverlayStats(callback=lambda *event: events.append(event))
+        overlay(self.df1, self.df2, how='intersection', stats=stats)
+
+        assert ('count', 'candidate_pairs', 3) in events
+        assert ('timing', 'total', stats.timings['total']) in events
+        flat = stats.to_dict()
+        assert flat['counts.intersections'] == 2
+        assert 'timings.query' in flat
+
+    def test_merge(self):
+        stats, other = OverlayStats(), OverlayStats()
+        stats.count('candidate_pairs', 2)
+        other.count('candidate_pairs', 3)
+        other.add_time('intersection', 0.5)
+        stats.merge(other)
+
+        assert stats.counts['candidate_pairs'] == 5
+        assert stats.timings['intersection'] == 0.5
+
+
+class TestGridSize:
+    """Checks the snapping of `spatial_overlay` to a precision grid."""
+
+    def setup_method(self):
+        square = Polygon([(0, 0), (10, 0), (10, 10), (0, 10)])
+        # the same square digitized again, a hair off, next to its neighbour
+        redrawn = Polygon([(0, 1e-7), (10 + 1e-7, 0), (10, 10), (0, 10 - 1e-7)])
+        neighbour = Polygon([(10, 0), (20, 0), (20, 10), (10, 10)])
+        self.df1 = GeoDataFrame({'value1': [1], 'geometry': [square]}, crs='EPSG:2263')
+        self.df2 = GeoDataFrame({'value2': [1, 2], 'geometry': [redrawn, neighbour]},
+                                crs='EPSG:2263')
+
+    def test_slivers_removed(self):
+        slivers = overlay(self.df1, self.df2, how='union')
+        assert len(slivers) > 3
+
+        stats = OverlayStats()
+        df = overlay(self.df1, self.df2, how='union', grid_size=0.01, stats=stats)
+        assert len(df) == 2
+        assert list(df['value2']) == [1, 2]
+        assert df.geometry.is_valid.all()
+        # the snapped geometries need no repair, and the neighbours that
+        # only share an edge are never overlaid
+        assert 'repair' not in stats.timings
+        assert stats.counts['pairs_touching'] == 1
+
+    @pytest.mark.parametrize('engine', ['cascade', 'reduce'])
+    def test_many_candidates(self, engine):
+        df1 = GeoDataFrame({'geometry': [Point(0, 0).buffer(10)]}, crs='EPSG:2263')
+        df2 = GeoDataFrame({'geometry': [Point(x, 5).buffer(3) for x in range(-9, 10, 3)]},
+                           crs='EPSG:2263')
+        expected = overlay(df1, df2, how='difference', engine=engine)
+        result = overlay(df1, df2, how='difference', engine=engine, grid_size=0.01)
+
+        assert result.geometry.is_valid.all()
+        assert (result.geom_type.isin(['Polygon', 'MultiPolygon'])).all()
+        assert abs(expected.area.sum() - result.area.sum()) < 0.1
+
+    def test_layer(self):
+        layer = OverlayLayer(self.df2, grid_size=0.01)
+        expected = overlay(self.df1, self.df2, how='intersection', grid_size=0.01)
+        for grid_size in [0.01, 0.1]:
+            result = overlay(self.df1, layer, how='intersection', grid_size=grid_size)
+            assert expected.shape == result.shape
+            assert expected.geom_equals(result).all()
+
+    def test_grid_size_units(self):
+        # EPSG:2263 is in US survey feet
+        assert _grid_size(0.5, self.df1.crs) == 0.5
+        assert abs(_grid_size((1, 'cm'), self.df1.crs) - 0.0328083) < 1e-6
+        assert _grid_size((2, 'us-ft'), self.df1.crs) == 2
+        with pytest.raises(ValueError):
+            _grid_size((1, 'cm'), self.df1.to_crs('EPSG:4326').crs)
+
+
+class TestFlattenOverlaps:
+    """Checks the planar partition of a single layer by `flatten_overlaps`."""
+
+    def setup_method(self):
+        ring = Point(0, 0).buffer(10).difference(Point(0, 0).buffer(5))
+        self.gdf = GeoDataFrame(
+            {'geometry': [Polygon([(0, 0), (2, 0), (2, 2), (0, 2)]),
+                          Polygon([(1, 1), (3, 1), (3, 3), (1, 3)]),
+                          Polygon([(20, 20), (21, 20), (21, 21), (20, 21)]),
+                          ring]},
+            crs='EPSG:2263')
+
+    def test_flatten_overlaps(self):
+        faces = flatten_overlaps(self.gdf)
+
+        assert list(faces['parents']) == [(0,), (0, 1), (1,), (2,), (3,)]
+        assert list(faces['n_parents']) == [1, 2, 1, 1, 1]
+        assert faces.crs == self.gdf.crs
+        # the faces do not overlap, and the hole of the ring is left out
+        assert abs(faces.area.sum() - self.gdf.unary_union.area) < 1e-6
+        assert abs(faces.area[1] - 1) < 1e-9
+
+    def test_parent_areas(self):
+        gdf = GeoDataFrame({'geometry': [Point(x, y).buffer(1.5) for x in range(4)
+                                         for y in range(3)]})
+        stats = OverlayStats()
+        faces = flatten_overlaps(gdf, stats=stats)
+
+        # every polygon is covered exactly by the faces that list it
+        for i, geom in enumerate(gdf.geometry):
+            covered = faces[[i in parents for parents in faces['parents']]].area.sum()
+            assert abs(covered - geom.area) < 1e-6
+        assert stats.counts['faces'] >= len(faces)
+        assert 'node' in stats.timings and 'label' in stats.timings
+
+    def test_grid_size(self):
+        faces = flatten_overlaps(self.gdf, grid_size=0.01)
+        assert list(faces['parents']) == [(0,), (0, 1), (1,), (2,), (3,)]
+        assert faces.geometry.is_valid.all()
+
+    def test_nonpoly(self):
+        with pytest.raises(TypeError):
+            flatten_overlaps(GeoDataFrame({'geometry': [Point(0, 0)]}))
+
+
+class TestMultiOverlay:
+    """`multi_overlay` should match chained `spatial_overlay` calls."""
+
+    def setup_method(self):
+        self.polydf = read_file(geopandas.datasets.get_path('nybb'))
+        b = [int(x) for x in self.polydf.total_bounds]
+
+        def circles(n, radius, shift=0):
+            return GeoDataFrame(
+                [{'geometry': Point(x + shift, y).buffer(radius), 'value1': x + y,
+                  'value2': x - y}
+                 for x, y in zip(range(b[0], b[2], int((b[2]-b[0])/n)),
+                                 range(b[1], b[3], int((b[3]-b[1])/n)))],
+                crs=self.polydf.crs,
+                )
+
+        self.layers = [self.polydf, circles(10, 10000), circles(13, 12000, 5000)]
+
+    def chained(self, how):
+        df = overlay(self.layers[0], self.layers[1], how=how, keep_index=True)
+        df = df.rename(columns={'idx1': 'first', 'idx2': 'second'})
+        df = overlay(df, self.layers[2], how=how, keep_index=True)
+        df = df.rename(columns={'idx2': 'idx3'})
+        df['idx1'], df['idx2'] = df['first'], df['second']
+        return df.sort_values(['idx1', 'idx2', 'idx3']).reset_index(drop=True)
+
+    @pytest.mark.parametrize('how', ['intersection', 'union', 'identity'])
+    @pytest.mark.parametrize('engine', ['cascade', 'polygonize'])
+    def test_multi_overlay(self, how, engine):
+        expected = self.chained(how)
+        result = multi_overlay(self.layers, how=how, engine=engine)
+
+        columns = ['idx1', 'idx2', 'idx3']
+        assert len(result) == len(expected)
+        assert result[columns].fillna(-1).equals(expected[columns].fillna(-1))
+        assert numpy.allclose(result.area, expected.area, rtol=1e-6)
+        assert list(result.columns) == [
+            'BoroCode', 'BoroName', 'Shape_Leng', 'Shape_Area', 'idx1',
+            'value1_2', 'value2_2', 'idx2', 'value1_3', 'value2_3', 'idx3', 'geometry']
+        inside = result['idx3'].notnull()
+        values = self.layers[2]['value1'].values[result.loc[inside, 'idx3'].astype(int)]
+        assert (result.loc[inside, 'value1_3'].values == values).all()
+        assert result.crs == self.polydf.crs
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    def test_layers_and_crs(self):
+        expected = multi_overlay(self.layers, how='intersection')
+        layers = [self.layers[0], OverlayLayer(self.layers[1]),
+                  self.layers[2].to_crs('EPSG:4326')]
+        result = multi_overlay(layers, how='intersection', explode=True)
+
+        assert result.crs == self.polydf.crs
+        assert len(result) >= len(expected)
+        assert abs(result.area.sum() - expected.area.sum()) < 1e-6 * expected.area.sum()
+
+    def test_join_order(self):
+        layers = [OverlayLayer(df) for df in self.layers]
+        # the boroughs overlap fewer of the small circles than the large ones
+        assert _join_order(layers, 'intersection') == [0, 1, 2]
+        assert _join_order(layers, 'identity')[0] == 0
+
+    def test_errors(self):
+        with pytest.raises(ValueError):
+            multi_overlay(self.layers[:1])
+        with pytest.raises(ValueError):
+            multi_overlay(self.layers, how='difference')
+        with pytest.raises(ValueError):
+            multi_overlay(self.layers, engine='nope')
+
+
+class TestTabulateIntersection:
+    """`tabulate_intersection` should measure what `spatial_overlay` builds."""
+
+    def setup_method(self):
+        N = 10
+
+        self.polydf = read_file(geopandas.datasets.get_path('nybb'))
+
+        b = [int(x) for x in self.polydf.total_bounds]
+        self.polydf2 = GeoDataFrame(
+            [{'geometry': Point(x, y).buffer(10000), 'value1': x + y,
+              'value2': x - y}
+             for x, y in zip(range(b[0], b[2], int((b[2]-b[0])/N)),
+                             range(b[1], b[3], int((b[3]-b[1])/N)))],
+            crs=self.polydf.crs,
+            )
+        self.lines = GeoDataFrame(
+            {'geometry': [LineString([(b[0], b[1]), (b[2], b[3])]),
+                          LineString([(b[0], b[3]), (b[2], b[1])])]},
+            crs=self.polydf.crs)
+
+    @pytest.mark.filterwarnings(ignore_diff_proj)
+    @pytest.mark.parametrize('df2', ['frame', 'layer', 'reprojected'])
+    def test_tabulate_intersection(self, df2):
+        df2 = {'frame': self.polydf,
+               'layer': OverlayLayer(self.polydf),
+               'reprojected': self.polydf.to_crs('EPSG:4326')}[df2]
+        expected = overlay(self.polydf2, self.polydf, how='intersection', keep_index=True)
+        expected = expected.sort_values(['idx1', 'idx2'])
+
+        idx1, idx2, area = tabulate_intersection(self.polydf2, df2)
+        order = numpy.lexsort([idx2, idx1])
+        assert list(idx1[order]) == list(expected['idx1'])
+        assert list(idx2[order]) == list(expected['idx2'])
+        assert numpy.allclose(area[order], expected.area, rtol=1e-6)
+
+    def test_sparse(self):
+        pytest.importorskip('scipy')
+        matrix = tabulate_intersection(self.polydf2, self.polydf, sparse=True)
+        idx1, idx2, area = tabulate_intersection(self.polydf2, self.polydf)
+
+        assert matrix.shape == (len(self.polydf2), len(self.polydf))
+        assert numpy.allclose(matrix[idx1, idx2].A1, area)
+        assert apportion(self.polydf2, self.polydf, ['value1'], table=matrix).equals(
+            apportion(self.polydf2, self.polydf, ['value1']))
+
+    def test_length(self):
+        idx1, idx2, length = tabulate_intersection(self.lines, self.polydf, measure='length')
+        for i, j, value in zip(idx1, idx2, length):
+            expected = self.lines.geometry[i].intersection(self.polydf.geometry[j]).length
+            assert abs(value - expected) < 1e-6
+        with pytest.raises(TypeError):
+            tabulate_intersection(self.polydf2, self.polydf, measure='length')
+
+    def test_apportion(self):
+        result = apportion(self.polydf2, self.polydf, ['value1', 'value2'])
+        assert list(result.columns) == ['value1', 'value2']
+        assert result.index.equals(self.polydf.index)
+
+        # each circle is split over the boroughs by the share of its area in each
+        expected = numpy.zeros(len(self.polydf))
+        for circle, value in zip(self.polydf2.geometry, self.polydf2['value1']):
+            for j, borough in enumerate(self.polydf.geometry):
+                expected[j] += value * circle.intersection(borough).area / circle.area
+        assert numpy.allclose(result['value1'], expected)
+
+        # the lines are apportioned by length
+        lengths = apportion(self.lines.assign(count=1), self.polydf, ['count'],
+                            measure='length')
+        assert (lengths['count'] <= 1).all() and lengths['count'].sum() > 0
+
+
+class TestUpdateOverlay:
+    """`update_overlay` should give the same rows as overlaying the changed
+    frames from scratch.
+    """
+
+    def setup_method(self):
+        self.cells1 = GeoDataFrame(
+            {'value': numpy.arange(36),
+             'geometry': [Polygon([(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1)])
+                          for x in range(6) for y in range(6)]})
+        self.cells2 = GeoDataFrame(
+            {'value': numpy.arange(16),
+             'geometry': [Point(x * 1.5 + 0.7, y * 1.5 + 0.7).buffer(0.9)
+                          for x in range(4) for y in range(4)]})
+
+    def changed(self):
+        cells1 = self.cells1.drop([3, 20])
+        cells1.loc[7, 'geometry'] = Point(1.2, 1.2).buffer(1.1)
+        added = GeoDataFrame({'value': [99], 'geometry': [Point(8, 8).buffer(1)]}, index=[40])
+        cells1 = GeoDataFrame(pandas.concat([cells1, added]))
+
+        cells2 = self.cells2.drop([5])
+        cells2.loc[10, 'geometry'] = Point(3, 4).buffer(1.4)
+        return cells1, [3, 20, 7, 40], cells2, [5, 10]
+
+    @pytest.mark.parametrize('how', ['intersection', 'identity', 'union'])
+    def test_update_overlay(self, how):
+        previous = overlay(self.cells1, self.cells2, how=how, keep_index=True)
+        assert previous.equals(update_overlay(None, self.cells1, self.cells2, how=how))
+
+        cells1, changed1, cells2, changed2 = self.changed()
+        expected = update_overlay(None, cells1, cells2, how=how)
+        result = update_overlay(previous, cells1, cells2, how=how, changed1=changed1,
+                                changed2=changed2)
+
+        columns = ['idx1', 'idx2']
+        expected = expected.sort_values(columns).reset_index(drop=True)
+        result = result.sort_values(columns).reset_index(drop=True)
+        assert list(result.columns) == list(previous.columns)
+        assert expected.drop('geometry', axis=1).equals(result.drop('geometry', axis=1))
+        assert numpy.allclose(expected.area, result.area)
+
+    def test_labels(self):
+        cells1 = self.cells1.set_index(self.cells1.index * 10)
+        result = update_overlay(None, cells1, self.cells2, how='identity')
+        assert set(result['idx1']) == set(cells1.index)
+
+    def test_errors(self):
+        previous = overlay(self.cells1, self.cells2, how='difference', keep_index=True)
+        with pytest.raises(ValueError):
+            update_overlay(previous, self.cells1, self.cells2, how='difference')
+        with pytest.raises(ValueError):
+            update_overlay(previous.drop('idx1', axis=1), self.cells1, self.cells2)
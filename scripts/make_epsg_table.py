@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Builds the bundled EPSG table `geopandas_ext/data/epsg.csv.gz` used by
+`geopandas_ext.epsg_utils` from the EPSG database shipped with `pyproj`.
+
+Each row holds the code, the proj4 string and the units of one projected or
+geographic 2D EPSG coordinate system.
+
+Usage: $python scripts/make_epsg_table.py
+
+"""
+
+import csv
+import gzip
+import io
+import os
+import warnings
+
+import pyproj
+from pyproj.database import query_crs_info
+from pyproj.enums import PJType
+
+
+OUT = os.path.join(os.path.dirname(__file__), '..', 'geopandas_ext', 'data', 'epsg.csv.gz')
+
+
+def rows():
+    infos = query_crs_info(
+        auth_name='EPSG', pj_types=[PJType.PROJECTED_CRS, PJType.GEOGRAPHIC_2D_CRS])
+    for info in sorted(infos, key=lambda i: int(i.code)):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            try:
+                proj4 = pyproj.CRS.from_epsg(int(info.code)).to_proj4()
+            except pyproj.exceptions.CRSError:
+                proj4 = None
+        if not proj4:
+            continue
+
+        params = [p for p in proj4.split() if p != '+type=crs']
+        units = ''
+        for p in params:
+            if p.startswith('+units='):
+                units = p.split('=', 1)[1]
+        if '+proj=longlat' in params:
+            units = 'degrees'
+        yield int(info.code), ' '.join(params), units
+
+
+def main():
+    with gzip.open(OUT, 'wb') as f:
+        text = io.TextIOWrapper(f, encoding='ascii', newline='')
+        writer = csv.writer(text, lineterminator='\n')
+        writer.writerow(['epsg', 'proj4', 'units'])
+        n = 0
+        for row in rows():
+            writer.writerow(row)
+            n += 1
+        text.flush()
+        text.detach()
+    print('wrote {} codes to {} (pyproj {}, PROJ {})'.format(
+        n, os.path.normpath(OUT), pyproj.__version__, pyproj.proj_version_str))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,10 +19,16 @@ with open('README.md') as readme_file:
     readme = readme_file.read()
 
 requirements = ["numpy", "pandas", "fiona",
-                "shapely", "geopandas", "requests",
-                "rtree", "pyepsg",
+                "shapely", "geopandas",
+                "rtree",
                 ]
 
+# epsg.io lookups for codes missing from the bundled EPSG table
+network_requirements = ["requests", "pyepsg"]
+
+# sparse matrices from `tabulate_intersection`
+sparse_requirements = ["scipy"]
+
 test_requirements = ['pytest>=3.1']
 
 setup(
@@ -34,8 +40,10 @@ setup(
     author_email=email,
     url='https://github.com/austinorr/geopandas_ext',
     packages=find_packages(),
+    package_data={'geopandas_ext': ['data/*.csv.gz']},
     install_requires=requirements,
-    extras_require={'testing': test_requirements},
+    extras_require={'testing': test_requirements, 'network': network_requirements,
+                    'sparse': sparse_requirements},
     license="BSD license",
     zip_safe=False,
     keywords=['gis', 'overlay', 'pandas', 'geopandas', 'epsg'],